@@ -0,0 +1,31 @@
+"""add index ix_logs_auditoria_data_evento_id_log on logs_auditoria (data_evento, id_log)
+
+Revision ID: a5b6c7d8e9f0
+Revises: f4d5e6a7b8c9
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "a5b6c7d8e9f0"
+down_revision: Union[str, None] = "f4d5e6a7b8c9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # IF NOT EXISTS para idempotência (ex.: create_all já criou o índice em dev)
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "CREATE INDEX IF NOT EXISTS ix_logs_auditoria_data_evento_id_log "
+        "ON logs_auditoria (data_evento, id_log)"
+    ))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_logs_auditoria_data_evento_id_log"))
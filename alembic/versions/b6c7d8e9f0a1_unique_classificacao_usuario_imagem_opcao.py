@@ -0,0 +1,49 @@
+"""classificacoes: índice único (id_con, id_img, id_opc) no lugar de idx_classificacao_usuario_imagem_opcao
+
+Revision ID: b6c7d8e9f0a1
+Revises: a5b6c7d8e9f0
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "b6c7d8e9f0a1"
+down_revision: Union[str, None] = "a5b6c7d8e9f0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # Remover duplicatas (mesmo usuário, imagem e opção) antes do índice único:
+    # mantém a linha ativa e, entre iguais, a mais recente
+    conn.execute(sa.text("""
+        DELETE FROM classificacoes c
+        USING (
+            SELECT id_cla,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY id_con, id_img, id_opc
+                       ORDER BY ativo DESC, data_criado DESC, id_cla
+                   ) AS rn
+            FROM classificacoes
+        ) d
+        WHERE c.id_cla = d.id_cla AND d.rn > 1
+    """))
+    conn.execute(sa.text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_classificacao_usuario_imagem_opcao "
+        "ON classificacoes (id_con, id_img, id_opc)"
+    ))
+    conn.execute(sa.text("DROP INDEX IF EXISTS idx_classificacao_usuario_imagem_opcao"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "CREATE INDEX IF NOT EXISTS idx_classificacao_usuario_imagem_opcao "
+        "ON classificacoes (id_con, id_img, id_opc)"
+    ))
+    conn.execute(sa.text("DROP INDEX IF EXISTS uq_classificacao_usuario_imagem_opcao"))
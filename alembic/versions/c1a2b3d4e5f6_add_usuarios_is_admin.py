@@ -0,0 +1,41 @@
+"""add usuarios.is_admin (desnormalização de tipo_usuarios.nome == 'admin')
+
+Revision ID: c1a2b3d4e5f6
+Revises: e7efd594e4cd
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "c1a2b3d4e5f6"
+down_revision: Union[str, None] = "e7efd594e4cd"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("""
+        ALTER TABLE usuarios
+        ADD COLUMN IF NOT EXISTS is_admin BOOLEAN NOT NULL DEFAULT FALSE
+    """))
+    # Preencher a partir do tipo atual de cada usuário (novos registros são mantidos pelo listener do ORM)
+    conn.execute(sa.text("""
+        UPDATE usuarios u
+        SET is_admin = (LOWER(t.nome) = 'admin')
+        FROM tipo_usuarios t
+        WHERE t.id_tipo = u.id_tipo
+    """))
+    conn.execute(sa.text(
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_is_admin ON usuarios (is_admin)"
+    ))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_usuarios_is_admin"))
+    conn.execute(sa.text("ALTER TABLE usuarios DROP COLUMN IF EXISTS is_admin"))
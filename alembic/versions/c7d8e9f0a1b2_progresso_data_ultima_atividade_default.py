@@ -0,0 +1,33 @@
+"""usuarios_ambientes_progresso.data_ultima_atividade com DEFAULT CURRENT_TIMESTAMP
+
+Revision ID: c7d8e9f0a1b2
+Revises: b6c7d8e9f0a1
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "c7d8e9f0a1b2"
+down_revision: Union[str, None] = "b6c7d8e9f0a1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("""
+        ALTER TABLE usuarios_ambientes_progresso
+        ALTER COLUMN data_ultima_atividade SET DEFAULT CURRENT_TIMESTAMP
+    """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("""
+        ALTER TABLE usuarios_ambientes_progresso
+        ALTER COLUMN data_ultima_atividade DROP DEFAULT
+    """))
@@ -0,0 +1,38 @@
+"""add unique index ix_usuarios_email_lower on usuarios (lower(email))
+
+Revision ID: d2b3c4e5f6a7
+Revises: c1a2b3d4e5f6
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "d2b3c4e5f6a7"
+down_revision: Union[str, None] = "c1a2b3d4e5f6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # E-mails duplicados ignorando maiúsculas/minúsculas impedem o índice único: a migração falha
+    # listando-os, para correção manual antes de reaplicá-la (não há como escolher qual conta manter).
+    # (Sem CONCURRENTLY: o Alembic executa a migração dentro de uma transação.)
+    conn = op.get_bind()
+    duplicados = conn.execute(sa.text(
+        "SELECT LOWER(email) FROM usuarios GROUP BY LOWER(email) HAVING COUNT(*) > 1 ORDER BY 1"
+    )).scalars().all()
+    if duplicados:
+        raise RuntimeError(
+            "Não é possível criar ix_usuarios_email_lower: e-mails duplicados (ignorando maiúsculas/minúsculas) "
+            f"em usuarios: {', '.join(duplicados)}"
+        )
+    conn.execute(sa.text("CREATE UNIQUE INDEX IF NOT EXISTS ix_usuarios_email_lower ON usuarios (LOWER(email))"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_usuarios_email_lower"))
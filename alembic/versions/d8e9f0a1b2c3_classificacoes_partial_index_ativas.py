@@ -0,0 +1,36 @@
+"""classificacoes: índice parcial (id_con, id_img) WHERE ativo no lugar de idx_classificacao_usuario_imagem_ativo
+
+Revision ID: d8e9f0a1b2c3
+Revises: c7d8e9f0a1b2
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "d8e9f0a1b2c3"
+down_revision: Union[str, None] = "c7d8e9f0a1b2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Todas as leituras por usuário filtram ativo = true; as linhas inativas ficam fora do índice
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "CREATE INDEX IF NOT EXISTS ix_classificacao_usuario_imagem_ativas "
+        "ON classificacoes (id_con, id_img) WHERE ativo"
+    ))
+    conn.execute(sa.text("DROP INDEX IF EXISTS idx_classificacao_usuario_imagem_ativo"))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "CREATE INDEX IF NOT EXISTS idx_classificacao_usuario_imagem_ativo "
+        "ON classificacoes (id_con, id_img, ativo)"
+    ))
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_classificacao_usuario_imagem_ativas"))
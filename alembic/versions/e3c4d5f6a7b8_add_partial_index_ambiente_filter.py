@@ -0,0 +1,31 @@
+"""add partial index on usuarios_ambientes (id_amb) WHERE ativo
+
+Revision ID: e3c4d5f6a7b8
+Revises: d2b3c4e5f6a7
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "e3c4d5f6a7b8"
+down_revision: Union[str, None] = "d2b3c4e5f6a7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # IF NOT EXISTS para idempotência (ex.: create_all já criou o índice em dev)
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_ambientes_id_amb_ativo "
+        "ON usuarios_ambientes (id_amb) WHERE ativo"
+    ))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_usuarios_ambientes_id_amb_ativo"))
@@ -0,0 +1,31 @@
+"""add partial index idx_imagem_keyset on imagens (id_cnj, data_proc, content_hash) WHERE existe_no_nextcloud
+
+Revision ID: f4d5e6a7b8c9
+Revises: e3c4d5f6a7b8
+Create Date: 2026-10-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "f4d5e6a7b8c9"
+down_revision: Union[str, None] = "e3c4d5f6a7b8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # IF NOT EXISTS para idempotência (ex.: create_all já criou o índice em dev)
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "CREATE INDEX IF NOT EXISTS idx_imagem_keyset "
+        "ON imagens (id_cnj, data_proc, content_hash) WHERE existe_no_nextcloud"
+    ))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("DROP INDEX IF EXISTS idx_imagem_keyset"))
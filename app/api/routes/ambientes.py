@@ -14,6 +14,7 @@ from app.db import models
 from datetime import datetime, timezone
 from app.db.models import EventoAuditoria, LogAuditoria
 from pydantic import BaseModel
+import uuid
 
 router = APIRouter(prefix="/ambientes", tags=["Ambientes"])
 
@@ -23,7 +24,7 @@ class AmbienteUpdateOpcoes(BaseModel):
 
 @router.get("/{id_amb}/preview-imagens")
 def preview_imagens_ambiente(
-    id_amb: str,
+    id_amb: uuid.UUID,
     admin: models.Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
@@ -45,7 +46,7 @@ def preview_imagens_ambiente(
 
 @router.patch("/{id_amb}/opcoes", status_code=200)
 def atualizar_opcoes_ambiente_route(
-    id_amb: str,
+    id_amb: uuid.UUID,
     payload: AmbienteUpdateOpcoes = Body(...),
     admin: models.Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -74,7 +75,7 @@ def atualizar_opcoes_ambiente_route(
             id_usu=admin.id_usu,
             evento_id=evento.id_evento,
             data_evento=datetime.now(timezone.utc),
-            detalhes={"id_amb": id_amb, "novas_opcoes": payload.opcoes}
+            detalhes={"id_amb": str(id_amb), "novas_opcoes": payload.opcoes}
         )
         db.add(log)
         db.commit()
@@ -194,7 +195,8 @@ def listar_ambientes(
     result = []
     for a in ambientes:
         nome_adm = a.administrador.usuario.nome_completo if a.administrador and a.administrador.usuario else "(desconhecido)"
-        ids_conjuntos = ambiente_crud.obter_conjuntos_do_ambiente(db, a.id_amb)
+        # Mesmo conteúdo de obter_conjuntos_do_ambiente (histórico completo), já carregado em lote
+        ids_conjuntos = [str(assoc.id_cnj) for assoc in a.conjuntos_imagens]
         total_imagens = totais_imagens.get(a.id_amb, 0)
         result.append(
             AmbienteOut(
@@ -214,13 +216,14 @@ def listar_ambientes(
     return result
 
 @router.delete("/{id_amb}", status_code=204)
-def excluir_ambiente_route(id_amb: str, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
+def excluir_ambiente_route(id_amb: uuid.UUID, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
     """
     Realiza a exclusão lógica (desativação) de um ambiente pelo ID.
     - **Acesso:** Apenas administradores autenticados.
     - **Respostas:**
       - 204: Ambiente desativado com sucesso
       - 404: Ambiente não encontrado ou já inativo
+      - 422: ID do ambiente inválido (não é UUID)
     """
     ambiente = ambiente_crud.excluir_ambiente(db, id_amb)
     if not ambiente:
@@ -234,14 +237,14 @@ def excluir_ambiente_route(id_amb: str, admin: models.Usuario = Depends(require_
             id_usu=admin.id_usu,
             evento_id=evento.id_evento,
             data_evento=datetime.now(timezone.utc),
-            detalhes={"id_amb": id_amb}
+            detalhes={"id_amb": str(id_amb)}
         )
         db.add(log)
         db.commit()
     return
 
 @router.patch("/{id_amb}/reativar", status_code=200)
-def reativar_ambiente_route(id_amb: str, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
+def reativar_ambiente_route(id_amb: uuid.UUID, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
     """
     Reativa um ambiente desativado pelo ID.
     
@@ -253,6 +256,7 @@ def reativar_ambiente_route(id_amb: str, admin: models.Usuario = Depends(require
     - **Respostas:**
       - 200: Ambiente reativado com sucesso
       - 404: Ambiente não encontrado, já ativo, ou não foi possível reativar (nenhum conjunto válido)
+      - 422: ID do ambiente inválido (não é UUID)
     """
     ambiente = ambiente_crud.reativar_ambiente(db, id_amb)
     if not ambiente:
@@ -270,7 +274,7 @@ def reativar_ambiente_route(id_amb: str, admin: models.Usuario = Depends(require
             id_usu=admin.id_usu,
             evento_id=evento.id_evento,
             data_evento=datetime.now(timezone.utc),
-            detalhes={"id_amb": id_amb}
+            detalhes={"id_amb": str(id_amb)}
         )
         db.add(log)
         db.commit()
@@ -296,7 +300,7 @@ def reativar_ambiente_route(id_amb: str, admin: models.Usuario = Depends(require
 
 @router.patch("/{id_amb}/titulo", response_model=AmbienteOut, status_code=200)
 def atualizar_titulo_ambiente(
-    id_amb: str,
+    id_amb: uuid.UUID,
     payload: AmbienteUpdateTitulo = Body(...),
     admin: models.Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -336,7 +340,7 @@ def atualizar_titulo_ambiente(
             id_usu=admin.id_usu,
             evento_id=evento.id_evento,
             data_evento=datetime.now(timezone.utc),
-            detalhes={"id_amb": id_amb, "novo_titulo": payload.titulo_amb}
+            detalhes={"id_amb": str(id_amb), "novo_titulo": payload.titulo_amb}
         )
         db.add(log)
         db.commit()
@@ -357,7 +361,7 @@ def atualizar_titulo_ambiente(
 
 @router.patch("/{id_amb}/descricao-questionario", response_model=AmbienteOut, status_code=200)
 def atualizar_descricao_questionario(
-    id_amb: str,
+    id_amb: uuid.UUID,
     payload: AmbienteUpdateDescricaoQuestionario = Body(...),
     admin: models.Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -396,7 +400,7 @@ def atualizar_descricao_questionario(
             id_usu=admin.id_usu,
             evento_id=evento.id_evento,
             data_evento=datetime.now(timezone.utc),
-            detalhes={"id_amb": id_amb}
+            detalhes={"id_amb": str(id_amb)}
         )
         db.add(log)
         db.commit()
@@ -417,7 +421,7 @@ def atualizar_descricao_questionario(
 
 @router.patch("/{id_amb}/titulo-questionario", response_model=AmbienteOut, status_code=200)
 def atualizar_titulo_questionario(
-    id_amb: str,
+    id_amb: uuid.UUID,
     payload: AmbienteUpdateTituloQuestionario = Body(...),
     admin: models.Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -457,7 +461,7 @@ def atualizar_titulo_questionario(
             id_usu=admin.id_usu,
             evento_id=evento.id_evento,
             data_evento=datetime.now(timezone.utc),
-            detalhes={"id_amb": id_amb, "novo_titulo": payload.titulo_questionario}
+            detalhes={"id_amb": str(id_amb), "novo_titulo": payload.titulo_questionario}
         )
         db.add(log)
         db.commit()
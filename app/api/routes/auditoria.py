@@ -6,6 +6,8 @@ from app.schemas.auth_schema import LogAuditoriaOut, EventoAuditoriaOut, LogAudi
 from app.crud import auditoria_crud
 from app.db.models import LogAuditoria, EventoAuditoria, Usuario
 from typing import Optional
+from datetime import datetime
+import uuid
 
 router = APIRouter(prefix="/auditoria", tags=["Auditoria"])
 
@@ -17,14 +19,22 @@ def listar_logs(
     id_evento: Optional[int] = Query(None),
     data_inicio: Optional[str] = Query(None),
     data_fim: Optional[str] = Query(None),
+    cursor_data_evento: Optional[datetime] = Query(None, description="data_evento do último log da página anterior (paginação por cursor)"),
+    cursor_id: Optional[uuid.UUID] = Query(None, description="id_log do último log da página anterior (paginação por cursor)"),
     admin: Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
-    logs, total = auditoria_crud.listar_logs(db, page, page_size, id_usuario, id_evento, data_inicio, data_fim)
+    if (cursor_data_evento is None) != (cursor_id is None):
+        exc = HTTPException(status_code=422, detail="Informe cursor_data_evento e cursor_id juntos para paginar por cursor.")
+        exc.code = "incomplete_cursor"
+        raise exc
+    logs, total, tem_mais = auditoria_crud.listar_logs(
+        db, page, page_size, id_usuario, id_evento, data_inicio, data_fim, cursor_data_evento, cursor_id
+    )
     log_out = []
     for log in logs:
-        usuario = db.query(Usuario).filter_by(id_usu=log.id_usu).first()
-        evento = db.query(EventoAuditoria).filter_by(id_evento=log.evento_id).first()
+        usuario = db.get(Usuario, log.id_usu)
+        evento = db.get(EventoAuditoria, log.evento_id)
         log_out.append(LogAuditoriaOut(
             id_log=str(log.id_log),
             id_usu=str(log.id_usu),
@@ -34,13 +44,16 @@ def listar_logs(
             data_evento=log.data_evento,
             detalhes=log.detalhes or {}
         ))
-    is_last_page = (page * page_size) >= total
+    # Cursor da próxima página: último log desta página (ordem data_evento DESC, id_log DESC)
+    ultimo = logs[-1] if tem_mais else None
     return LogAuditoriaPage(
         logs=log_out,
         page=page,
         page_size=page_size,
         total=total,
-        is_last_page=is_last_page
+        is_last_page=not tem_mais,
+        next_cursor_data_evento=ultimo.data_evento if ultimo else None,
+        next_cursor_id=str(ultimo.id_log) if ultimo else None
     )
 
 @router.get("/eventos", response_model=list[EventoAuditoriaOut])
@@ -164,7 +164,7 @@ def cadastrar_usuario(
         raise exc
     
     # Determinar tipo de usuário baseado no cadastro permitido
-    tipo_usuario = db.query(models.TipoUsuario).filter(models.TipoUsuario.id_tipo == cadastro.id_tipo).first()
+    tipo_usuario = db.get(models.TipoUsuario, cadastro.id_tipo)
     if not tipo_usuario:
         exc = HTTPException(status_code=500, detail="Tipo de usuário não encontrado.")
         exc.code = "user_type_not_found"
@@ -2,7 +2,7 @@
 Rotas para classificação de imagens em ambientes.
 """
 from fastapi import APIRouter, Depends, HTTPException, status, Path, Body, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import desc
 from app.db.database import get_db
 from app.services.auth_service import get_current_user
@@ -18,7 +18,7 @@ from app.schemas.classificacao_schema import (
 )
 from app.crud import classificacao_crud
 from app.db import models
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 from datetime import datetime
 import logging
@@ -46,7 +46,7 @@ class HistoricoResponse(BaseModel):
 def _montar_resposta_imagens(
     db: Session,
     imagens: List[models.Imagem],
-    id_con: str,
+    id_con: uuid.UUID,
     tem_mais: bool
 ) -> ImagensClassificacaoResponse:
     """
@@ -78,15 +78,12 @@ def _montar_resposta_imagens(
         # Converter classificações para o formato de saída
         classificacoes_out = []
         for classificacao in classificacoes_lista:
-            # Buscar texto da opção
-            opcao = db.query(models.Opcao).filter_by(id_opc=classificacao.id_opc).first()
-            texto_opcao = opcao.texto if opcao else "Opção não encontrada"
-            
+            # Texto da opção já vem na linha (JOIN no CRUD)
             classificacoes_out.append(
                 ClassificacaoInfoOut(
                     id_cla=str(classificacao.id_cla),
                     id_opc=str(classificacao.id_opc),
-                    texto_opcao=texto_opcao,
+                    texto_opcao=classificacao.texto_opcao,
                     data_criado=classificacao.data_criado,
                     data_modificado=classificacao.data_modificado
                 )
@@ -107,11 +104,13 @@ def _montar_resposta_imagens(
     return ImagensClassificacaoResponse(
         imagens=imagens_out,
         total=len(imagens_out),
-        tem_mais=tem_mais
+        tem_mais=tem_mais,
+        next_cursor=classificacao_crud.codificar_cursor(imagens[-1].id_cnj, imagens[-1].data_proc, imagens[-1].content_hash) if imagens else None,
+        prev_cursor=classificacao_crud.codificar_cursor(imagens[0].id_cnj, imagens[0].data_proc, imagens[0].content_hash) if imagens else None
     )
 
 
-def _obter_id_con_usuario(db: Session, usuario: models.Usuario) -> str:
+def _obter_id_con_usuario(db: Session, usuario: models.Usuario) -> uuid.UUID:
     """
     Obtém o ID do usuário convencional a partir do usuário.
     """
@@ -120,10 +119,28 @@ def _obter_id_con_usuario(db: Session, usuario: models.Usuario) -> str:
             status_code=403,
             detail="Apenas usuários convencionais podem classificar imagens."
         )
-    return str(usuario.convencional.id_con)
+    return usuario.convencional.id_con
 
 
-def _verificar_acesso_ambiente(db: Session, id_con: str, id_amb: str) -> bool:
+def _obter_cursor(request) -> Optional[Tuple[uuid.UUID, datetime, str]]:
+    """
+    Decodifica o cursor de /avancar e /voltar; sem cursor, exige content_hash (busca da imagem de referência).
+    """
+    if request.cursor:
+        cursor = classificacao_crud.decodificar_cursor(request.cursor)
+        if cursor is None:
+            exc = HTTPException(status_code=422, detail="Cursor de paginação inválido.")
+            exc.code = "invalid_cursor"
+            raise exc
+        return cursor
+    if not request.content_hash:
+        exc = HTTPException(status_code=422, detail="Informe cursor ou content_hash.")
+        exc.code = "missing_cursor"
+        raise exc
+    return None
+
+
+def _verificar_acesso_ambiente(db: Session, id_con: uuid.UUID, id_amb: uuid.UUID) -> bool:
     """
     Verifica se o usuário tem acesso ao ambiente (associação ativa).
     
@@ -135,15 +152,9 @@ def _verificar_acesso_ambiente(db: Session, id_con: str, id_amb: str) -> bool:
     Returns:
         True se tem acesso, False caso contrário
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
-        return False
-    
     associacao = db.query(models.UsuarioAmbiente).filter_by(
-        id_con=id_con_uuid,
-        id_amb=id_amb_uuid,
+        id_con=id_con,
+        id_amb=id_amb,
         ativo=True
     ).first()
     
@@ -152,7 +163,7 @@ def _verificar_acesso_ambiente(db: Session, id_con: str, id_amb: str) -> bool:
     
     # Verificar se o ambiente está ativo
     ambiente = db.query(models.Ambiente).filter_by(
-        id_amb=id_amb_uuid,
+        id_amb=id_amb,
         ativo=True
     ).first()
     
@@ -161,7 +172,7 @@ def _verificar_acesso_ambiente(db: Session, id_con: str, id_amb: str) -> bool:
 
 @router.get("/ambiente/{id_amb}/inicializar", response_model=ImagensClassificacaoResponse)
 def inicializar_classificacao(
-    id_amb: str = Path(..., description="ID do ambiente"),
+    id_amb: uuid.UUID = Path(..., description="ID do ambiente"),
     usuario: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -236,7 +247,7 @@ def obter_contagem_classificacoes(
         return {"total": 0}
 @router.post("/ambiente/{id_amb}/avancar", response_model=ImagensClassificacaoResponse)
 def avancar_imagens(
-    id_amb: str = Path(..., description="ID do ambiente"),
+    id_amb: uuid.UUID = Path(..., description="ID do ambiente"),
     request: AvancarRequest = Body(...),
     usuario: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -249,7 +260,7 @@ def avancar_imagens(
     
     - **Acesso:** Usuários autenticados (convencionais)
     - **Autenticação:** JWT (via cookie HttpOnly ou Bearer token)
-    - **Body:** Hash da imagem atual
+    - **Body:** next_cursor da resposta anterior ou hash da imagem atual
     - **Resposta:** Lista de até 20 imagens com suas classificações (se existirem)
     """
     try:
@@ -262,9 +273,9 @@ def avancar_imagens(
                 detail="Você não tem acesso a este ambiente ou o ambiente está inativo."
             )
         
-        # Buscar próximas imagens
+        # Buscar próximas imagens (pelo cursor, sem buscar a imagem atual, ou pelo content_hash)
         imagens, tem_mais = classificacao_crud.buscar_imagens_avancar(
-            db, id_amb, id_con, request.content_hash, limit=20
+            db, id_amb, id_con, request.content_hash, limit=20, cursor=_obter_cursor(request)
         )
         
         if not imagens:
@@ -287,7 +298,7 @@ def avancar_imagens(
 
 @router.post("/ambiente/{id_amb}/voltar", response_model=ImagensClassificacaoResponse)
 def voltar_imagens(
-    id_amb: str = Path(..., description="ID do ambiente"),
+    id_amb: uuid.UUID = Path(..., description="ID do ambiente"),
     request: VoltarRequest = Body(...),
     usuario: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -300,7 +311,7 @@ def voltar_imagens(
     
     - **Acesso:** Usuários autenticados (convencionais)
     - **Autenticação:** JWT (via cookie HttpOnly ou Bearer token)
-    - **Body:** Hash da imagem atual
+    - **Body:** prev_cursor da resposta anterior ou hash da imagem atual
     - **Resposta:** Lista de até 20 imagens com suas classificações (se existirem)
     """
     try:
@@ -313,9 +324,9 @@ def voltar_imagens(
                 detail="Você não tem acesso a este ambiente ou o ambiente está inativo."
             )
         
-        # Buscar imagens anteriores
+        # Buscar imagens anteriores (pelo cursor, sem buscar a imagem atual, ou pelo content_hash)
         imagens, tem_mais = classificacao_crud.buscar_imagens_voltar(
-            db, id_amb, id_con, request.content_hash, limit=20
+            db, id_amb, id_con, request.content_hash, limit=20, cursor=_obter_cursor(request)
         )
         
         if not imagens:
@@ -338,7 +349,7 @@ def voltar_imagens(
 
 @router.post("/ambiente/{id_amb}/classificar", response_model=ClassificarResponse)
 def classificar_imagem(
-    id_amb: str = Path(..., description="ID do ambiente"),
+    id_amb: uuid.UUID = Path(..., description="ID do ambiente"),
     request: ClassificarRequest = Body(...),
     usuario: models.Usuario = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -364,19 +375,17 @@ def classificar_imagem(
                 detail="Você não tem acesso a este ambiente ou o ambiente está inativo."
             )
         
-        # Verificar se a imagem pertence ao ambiente
-        imagem = db.query(models.Imagem).filter_by(content_hash=request.content_hash).first()
-        if imagem:
-            conjuntos_ids = classificacao_crud.buscar_conjuntos_ambiente(db, id_amb)
-            if imagem.id_cnj not in conjuntos_ids:
-                raise HTTPException(
-                    status_code=400,
-                    detail="A imagem não pertence a este ambiente."
-                )
+        # Verificar se a imagem pertence ao ambiente (uma consulta, repassada ao CRUD)
+        imagem = classificacao_crud.buscar_imagem_no_ambiente(db, id_amb, request.content_hash)
+        if imagem and not imagem.pertence:
+            raise HTTPException(
+                status_code=400,
+                detail="A imagem não pertence a este ambiente."
+            )
         
         # Criar ou atualizar classificações (aceita múltiplas opções)
         classificacoes, total_novas = classificacao_crud.criar_ou_atualizar_classificacao(
-            db, id_con, id_amb, request.content_hash, request.id_opc
+            db, id_con, id_amb, request.content_hash, request.id_opc, imagem=imagem
         )
         
         if not classificacoes:
@@ -385,11 +394,11 @@ def classificar_imagem(
                 detail="Não foi possível criar/atualizar a classificação. Verifique se a imagem e as opções são válidas."
             )
         
-        # Buscar textos das opções e montar resposta
+        # Textos das opções (em memória; só as ainda não vistas vão ao banco) e montar resposta
+        textos_opcoes = classificacao_crud.obter_textos_opcoes(db, (c.id_opc for c in classificacoes))
         classificacoes_out = []
         for classificacao in classificacoes:
-            opcao = db.query(models.Opcao).filter_by(id_opc=classificacao.id_opc).first()
-            texto_opcao = opcao.texto if opcao else "Opção não encontrada"
+            texto_opcao = textos_opcoes.get(classificacao.id_opc, "Opção não encontrada")
             
             classificacoes_out.append(
                 ClassificacaoInfoOut(
@@ -437,28 +446,21 @@ def obter_classificacoes_imagem(
     - **Resposta:** Lista de classificações ativas do usuário para aquela imagem
     """
     try:
-        id_con_str = _obter_id_con_usuario(db, usuario)
-        
-        # Converter id_con para UUID
-        try:
-            id_con_uuid = uuid.UUID(id_con_str) if isinstance(id_con_str, str) else id_con_str
-        except (ValueError, TypeError):
-            raise HTTPException(
-                status_code=400,
-                detail="ID do usuário inválido."
-            )
+        id_con = _obter_id_con_usuario(db, usuario)
         
         # Verificar se a imagem existe
-        imagem = db.query(models.Imagem).filter_by(content_hash=content_hash).first()
+        imagem = db.get(models.Imagem, content_hash)
         if not imagem:
             raise HTTPException(
                 status_code=404,
                 detail="Imagem não encontrada."
             )
         
-        # Buscar classificações ativas do usuário para esta imagem
-        classificacoes = db.query(models.Classificacao).filter(
-            models.Classificacao.id_con == id_con_uuid,
+        # Buscar classificações ativas do usuário para esta imagem (opções num único SELECT ... IN)
+        classificacoes = db.query(models.Classificacao).options(
+            selectinload(models.Classificacao.opcao)
+        ).filter(
+            models.Classificacao.id_con == id_con,
             models.Classificacao.id_img == content_hash,
             models.Classificacao.ativo == True
         ).all()
@@ -466,7 +468,7 @@ def obter_classificacoes_imagem(
         # Converter classificações para o formato de saída
         classificacoes_out = []
         for classificacao in classificacoes:
-            opcao = db.query(models.Opcao).filter_by(id_opc=classificacao.id_opc).first()
+            opcao = classificacao.opcao
             texto_opcao = opcao.texto if opcao else "Opção não encontrada"
             
             classificacoes_out.append(
@@ -497,7 +499,7 @@ def obter_classificacoes_imagem(
 
 @router.get("/historico", response_model=HistoricoResponse)
 def listar_historico_usuario(
-    id_amb: Optional[str] = Query(None, description="Filtrar por ID do ambiente (opcional)"),
+    id_amb: Optional[uuid.UUID] = Query(None, description="Filtrar por ID do ambiente (opcional)"),
     page: int = Query(1, ge=1),
     page_size: int = Query(50, ge=1, le=100),
     usuario: models.Usuario = Depends(get_current_user),
@@ -546,7 +548,7 @@ def listar_historico_usuario(
         for classificacao, imagem, opcao, conjunto, ambiente in resultados:
             
             # DEFINE O ID DO AMBIENTE DE FORMA SEGURA
-            final_id_amb = id_amb if id_amb else str(ambiente.id_amb)
+            final_id_amb = str(id_amb if id_amb else ambiente.id_amb)
 
             if imagem.content_hash in grouped_items:
                 item_existente = grouped_items[imagem.content_hash]
@@ -62,7 +62,7 @@ async def buscar_imagens_por_hash(
             content_hash = hashlib.sha256(image_data).hexdigest()
             
             # Buscar imagem no banco de dados usando o hash como chave primária
-            imagem = db.query(Imagem).filter_by(content_hash=content_hash).first()
+            imagem = db.get(Imagem, content_hash)
             
             if imagem:
                 total_encontradas += 1
@@ -1,59 +1,140 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session, selectinload
+from typing import Optional
 from app.db.database import get_db
 from app.services.auth_service import require_admin
-from app.schemas.auth_schema import UsuarioOut
+from app.schemas.auth_schema import UsuarioOut, UsuarioPage
 from app.core.utils import validar_cpf, validar_nome, validar_forca_senha
-from app.crud.user_crud import get_user_by_email, get_user_by_cpf, create_usuario_convencional, create_usuario_administrador
+from app.crud.user_crud import get_user_by_email, get_user_by_id, get_user_by_cpf, create_usuario_convencional, create_usuario_administrador
 from app.crud.cadastro_permitido_crud import get_cadastro_permitido_by_email, marcar_cadastro_como_usado
 from app.services.auth_service import get_current_user, verify_password, get_password_hash
 from app.schemas.auth_schema import UsuarioUpdatePerfil, UsuarioUpdateSenha
 from app.db import models
 from datetime import datetime, timezone
+import json
 
 router = APIRouter(prefix="/usuarios", tags=["Gerenciar Usuários"])
 
 # Remover as rotas de cadastro de usuário convencional e administrador deste arquivo
 
-@router.get("/", response_model=list[UsuarioOut], tags=["Gerenciar Usuários"])
+def _filtros_usuarios(search: Optional[str], tipo: Optional[str]) -> list:
+    """Condições de busca/filtro da listagem de usuários (o filtro por tipo exige join com TipoUsuario)."""
+    filtros = []
+    if search:
+        termo = search.strip().lower()
+        filtros.append(or_(
+            func.lower(models.Usuario.nome_completo).contains(termo, autoescape=True),
+            func.lower(models.Usuario.email).contains(termo, autoescape=True)
+        ))
+    if tipo:
+        filtros.append(func.lower(models.TipoUsuario.nome) == tipo.strip().lower())
+    return filtros
+
+
+def _usuario_out(u: models.Usuario) -> UsuarioOut:
+    """
+    Monta o UsuarioOut de um usuário vindo do ORM sem passar pela validação do Pydantic
+    (model_construct). Usar apenas com dados internos já consistentes com o schema.
+    """
+    cpf = None
+    id_con = None
+    # Lógica para capturar IDs específicos
+    if u.convencional:
+        cpf = u.convencional.cpf
+        id_con = str(u.convencional.id_con)  # ID do especialista (usuário convencional)
+    elif u.administrador:
+        cpf = u.administrador.cpf
+
+    return UsuarioOut.model_construct(
+        id_usu=str(u.id_usu),
+        id_con=id_con,
+        nome_completo=u.nome_completo,
+        email=u.email,
+        telefone=u.telefone,
+        tipo=u.tipo.nome if u.tipo else "desconhecido",
+        cpf=cpf,
+        is_admin=u.is_admin,
+        ativo=u.ativo
+    )
+
+@router.get("/", response_model=UsuarioPage, tags=["Gerenciar Usuários"])
 def listar_usuarios(
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    search: Optional[str] = Query(None, description="Busca por nome ou e-mail (sem diferenciar maiúsculas)"),
+    tipo: Optional[str] = Query(None, description="Filtra pelo nome do tipo de usuário (ex.: admin, convencional)"),
     admin: models.Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """
-    Lista todos os usuários do sistema.
+    Lista os usuários do sistema de forma paginada (limit/offset), com busca e filtro por tipo.
     ATUALIZADO: Agora retorna id_con se for especialista.
     """
-    usuarios = db.query(models.Usuario).all()
-    result = []
-    for u in usuarios:
-        tipo = u.tipo.nome if u.tipo else "desconhecido"
-        is_admin = u.tipo and u.tipo.nome.lower() == "admin"
-        
-        cpf = None
-        id_con = None  # <--- Variável nova
-        
-        # Lógica para capturar IDs específicos
-        if u.convencional:
-            cpf = u.convencional.cpf
-            id_con = str(u.convencional.id_con) # <--- PEGA O ID DO MÉDICO
-        elif u.administrador:
-            cpf = u.administrador.cpf
-            
-        result.append(
-            UsuarioOut(
-                id_usu=str(u.id_usu),
-                id_con=id_con,          # <--- PREENCHE NO JSON
-                nome_completo=u.nome_completo,
-                email=u.email,
-                telefone=u.telefone,
-                tipo=tipo,
-                cpf=cpf,
-                is_admin=is_admin,
-                ativo=u.ativo
-            )
+    query = db.query(models.Usuario).filter(*_filtros_usuarios(search, tipo))
+    if tipo:
+        query = query.join(models.Usuario.tipo)
+    total = query.count()
+    usuarios = (
+        query.options(
+            selectinload(models.Usuario.tipo),
+            selectinload(models.Usuario.convencional),
+            selectinload(models.Usuario.administrador)
+        )
+        .order_by(models.Usuario.nome_completo, models.Usuario.id_usu)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return UsuarioPage.model_construct(
+        items=[_usuario_out(u) for u in usuarios],
+        total=total,
+        limit=limit,
+        offset=offset
+    )
+
+@router.get("/stream", tags=["Gerenciar Usuários"])
+def listar_usuarios_stream(
+    search: Optional[str] = Query(None, description="Busca por nome ou e-mail (sem diferenciar maiúsculas)"),
+    tipo: Optional[str] = Query(None, description="Filtra pelo nome do tipo de usuário (ex.: admin, convencional)"),
+    admin: models.Usuario = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Lista todos os usuários em NDJSON (um objeto JSON por linha, mesmos campos de UsuarioOut).
+
+    As linhas são lidas do banco em lotes (cursor no servidor) e enviadas à medida que chegam,
+    sem montar a lista inteira em memória. Aceita os mesmos filtros `search` e `tipo` de GET /usuarios.
+    """
+    stmt = (
+        select(
+            models.Usuario.id_usu,
+            models.UsuarioConvencional.id_con,
+            models.Usuario.nome_completo,
+            models.Usuario.email,
+            models.Usuario.telefone,
+            func.coalesce(models.TipoUsuario.nome, "desconhecido").label("tipo"),
+            func.coalesce(models.UsuarioConvencional.cpf, models.UsuarioAdministrador.cpf).label("cpf"),
+            models.Usuario.is_admin,
+            models.Usuario.ativo
         )
-    return result
+        .outerjoin(models.TipoUsuario, models.TipoUsuario.id_tipo == models.Usuario.id_tipo)
+        .outerjoin(models.UsuarioConvencional, models.UsuarioConvencional.id_usu == models.Usuario.id_usu)
+        .outerjoin(models.UsuarioAdministrador, models.UsuarioAdministrador.id_usu == models.Usuario.id_usu)
+        .where(*_filtros_usuarios(search, tipo))
+        .order_by(models.Usuario.nome_completo, models.Usuario.id_usu)
+        .execution_options(yield_per=200)
+    )
+
+    def gerar_linhas():
+        for row in db.execute(stmt).mappings():
+            item = dict(row)
+            item["id_usu"] = str(item["id_usu"])
+            item["id_con"] = str(item["id_con"]) if item["id_con"] else None
+            yield json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n"
+
+    return StreamingResponse(gerar_linhas(), media_type="application/x-ndjson")
 
 @router.delete("/{id_usu}", status_code=204, tags=["Gerenciar Usuários"])
 def excluir_usuario(
@@ -70,7 +151,7 @@ def excluir_usuario(
       - 404: Usuário não encontrado
       - 400/403: Erros de negócio
     """
-    usuario = db.query(models.Usuario).filter(models.Usuario.id_usu == id_usu).first()
+    usuario = get_user_by_id(db, id_usu)
     if not usuario:
         exc = HTTPException(status_code=404, detail="Usuário não encontrado.")
         exc.code = "user_not_found"
@@ -102,7 +183,7 @@ def reativar_usuario(
       - 404: Usuário não encontrado
       - 400: Usuário já está ativo
     """
-    usuario = db.query(models.Usuario).filter(models.Usuario.id_usu == id_usu).first()
+    usuario = get_user_by_id(db, id_usu)
     if not usuario:
         exc = HTTPException(status_code=404, detail="Usuário não encontrado.")
         exc.code = "user_not_found"
@@ -124,7 +205,6 @@ def ler_meus_dados(
 ):
     """Retorna os dados do usuário logado."""
     tipo = current_user.tipo.nome if current_user.tipo else "desconhecido"
-    is_admin = current_user.tipo and current_user.tipo.nome.lower() == "admin"
     
     cpf = None
     if current_user.convencional:
@@ -139,7 +219,7 @@ def ler_meus_dados(
         telefone=current_user.telefone, # Agora retornamos o telefone
         tipo=tipo,
         cpf=cpf,
-        is_admin=is_admin,
+        is_admin=current_user.is_admin,
         ativo=current_user.ativo
     )
 
@@ -155,18 +235,21 @@ def atualizar_meu_perfil(
     if dados.telefone:
         current_user.telefone = dados.telefone
     if dados.email:
-        # Verifica se o email já está em uso por OUTRA pessoa
-        existente = db.query(models.Usuario).filter(models.Usuario.email == dados.email).first()
-        if existente and existente.id_usu != current_user.id_usu:
+        # Verifica se o email já está em uso por OUTRA pessoa (EXISTS sobre o índice lower(email))
+        em_uso = db.query(
+            db.query(models.Usuario).filter(
+                func.lower(models.Usuario.email) == dados.email.lower(),
+                models.Usuario.id_usu != current_user.id_usu
+            ).exists()
+        ).scalar()
+        if em_uso:
             raise HTTPException(status_code=400, detail="Este e-mail já está em uso.")
         current_user.email = dados.email
     
     db.commit()
-    db.refresh(current_user)
     
     # Reutiliza a lógica de retorno (copie a lógica do 'cpf' e 'tipo' do GET acima)
     tipo = current_user.tipo.nome if current_user.tipo else "desconhecido"
-    is_admin = current_user.tipo and current_user.tipo.nome.lower() == "admin"
     cpf = current_user.convencional.cpf if current_user.convencional else (current_user.administrador.cpf if current_user.administrador else None)
 
     return UsuarioOut(
@@ -176,7 +259,7 @@ def atualizar_meu_perfil(
         telefone=current_user.telefone,
         tipo=tipo,
         cpf=cpf,
-        is_admin=is_admin,
+        is_admin=current_user.is_admin,
         ativo=current_user.ativo
     )
 
@@ -1,18 +1,19 @@
 """
 Rotas para gerenciamento de associações entre Usuários Convencionais e Ambientes.
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Path, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Body, Path, Query
 from sqlalchemy.orm import Session
 from app.db.database import get_db
 from app.services.auth_service import require_admin, get_current_user
 from app.schemas.auth_schema import (
     UsuarioAmbienteAssociarIn,
     UsuarioAmbientesOut,
-    AmbienteInfoOut,
     AmbienteUsuariosOut,
+    AmbienteInfoOut,
     UsuarioInfoOut
 )
 from app.crud import usuarios_ambientes_crud
+from app.services.auditoria_service import registrar_log_auditoria
 from app.db.models import EventoAuditoria, LogAuditoria, Usuario
 from datetime import datetime, timezone
 from typing import Optional
@@ -69,25 +70,12 @@ def meus_ambientes(
         exc.code = "usuario_not_found"
         raise exc
     
-    # Converter ambientes para o schema
-    ambientes_out = [
-        AmbienteInfoOut(
-            id_amb=amb["id_amb"],
-            titulo_amb=amb["titulo_amb"],
-            descricao_questionario=amb["descricao_questionario"],
-            ativo=amb["ativo"],
-            total_imagens=amb.get("total_imagens", 0),
-            total_classificadas=amb.get("total_classificadas", 0),
-            multipla_escolha=amb.get("multipla_escolha", False) 
-        )
-        for amb in ambientes
-    ]
-    
     return UsuarioAmbientesOut(
         id_con=str(usuario_conv.id_con),
         nome_completo=usuario_conv.usuario.nome_completo,
         email=usuario_conv.usuario.email,
-        ambientes=ambientes_out
+        # Linhas da consulta já validadas pelo banco: model_construct dispensa a validação por campo
+        ambientes=[AmbienteInfoOut.model_construct(**row) for row in ambientes]
     )
 
 
@@ -131,25 +119,12 @@ def listar_ambientes_usuario(
         exc.code = "usuario_not_found"
         raise exc
     
-    # Converter ambientes para o schema
-    ambientes_out = [
-        AmbienteInfoOut(
-            id_amb=amb["id_amb"],
-            titulo_amb=amb["titulo_amb"],
-            descricao_questionario=amb["descricao_questionario"],
-            ativo=amb["ativo"],
-            total_imagens=amb.get("total_imagens", 0),
-            total_classificadas=amb.get("total_classificadas", 0),
-            multipla_escolha=amb.get("multipla_escolha", False)
-        )
-        for amb in ambientes
-    ]
-    
     return UsuarioAmbientesOut(
         id_con=str(usuario_conv.id_con),
         nome_completo=usuario_conv.usuario.nome_completo,
         email=usuario_conv.usuario.email,
-        ambientes=ambientes_out
+        # Linhas da consulta já validadas pelo banco: model_construct dispensa a validação por campo
+        ambientes=[AmbienteInfoOut.model_construct(**row) for row in ambientes]
     )
 
 
@@ -167,7 +142,7 @@ def criar_associacoes(
     - **Parâmetros:**
       - **id_amb**: ID do ambiente
     - **Payload:**
-      - **ids_usuarios**: Lista de IDs de usuários convencionais (mínimo 1)
+      - **ids_usuarios**: Lista de IDs de usuários convencionais (mínimo 1; duplicados são ignorados)
     - **Validações:**
       - Ambiente deve existir e estar ativo
       - Todos os IDs de usuários devem ser válidos e existir
@@ -175,11 +150,11 @@ def criar_associacoes(
       - Não cria associações duplicadas
     - **Respostas:**
       - 200: Associações criadas com sucesso
-      - 400: IDs inválidos ou lista vazia
+      - 422: IDs em formato inválido (não UUID) ou lista vazia
       - 404: Ambiente não encontrado ou inativo
     """
     ambiente, associados = usuarios_ambientes_crud.criar_associacoes(
-        db, id_amb, payload.ids_usuarios
+        db, id_amb, payload.ids_usuarios, commit=False
     )
     
     if ambiente is None:
@@ -190,7 +165,7 @@ def criar_associacoes(
         exc.code = "ambiente_not_found_or_invalid_ids"
         raise exc
     
-    # Auditoria
+    # Auditoria (mesma transação da alteração: um único commit)
     evento = db.query(EventoAuditoria).filter_by(nome="associar_usuarios_ambiente").first()
     if evento:
         log = LogAuditoria(
@@ -204,7 +179,7 @@ def criar_associacoes(
             }
         )
         db.add(log)
-        db.commit()
+    db.commit()
     
     return {
         "message": f"{len(associados)} usuário(s) associado(s) ao ambiente com sucesso.",
@@ -216,6 +191,7 @@ def criar_associacoes(
 
 @router.post("/{id_amb}/associar-todos", status_code=200)
 def associar_todos_usuarios(
+    background_tasks: BackgroundTasks,
     id_amb: str = Path(..., description="ID do ambiente"),
     admin: Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -244,17 +220,13 @@ def associar_todos_usuarios(
         exc.code = "ambiente_not_found"
         raise exc
     
-    # Auditoria
-    evento = db.query(EventoAuditoria).filter_by(nome="associar_todos_usuarios_ambiente").first()
-    if evento:
-        log = LogAuditoria(
-            id_usu=admin.id_usu,
-            evento_id=evento.id_evento,
-            data_evento=datetime.now(timezone.utc),
-            detalhes={"id_amb": id_amb, "total_associados": count}
-        )
-        db.add(log)
-        db.commit()
+    # Auditoria em segundo plano (a associação já foi confirmada pelo CRUD)
+    background_tasks.add_task(
+        registrar_log_auditoria,
+        admin.id_usu,
+        "associar_todos_usuarios_ambiente",
+        {"id_amb": id_amb, "total_associados": count}
+    )
     
     return {
         "message": f"{count} usuário(s) convencional(is) associado(s) ao ambiente.",
@@ -284,7 +256,7 @@ def excluir_associacao(
       - 204: Associação excluída com sucesso
       - 404: Associação não encontrada ou já inativa
     """
-    vinculo = usuarios_ambientes_crud.excluir_associacao(db, id_con, id_amb)
+    vinculo = usuarios_ambientes_crud.excluir_associacao(db, id_con, id_amb, commit=False)
     
     if not vinculo:
         exc = HTTPException(
@@ -294,7 +266,7 @@ def excluir_associacao(
         exc.code = "associacao_not_found"
         raise exc
     
-    # Auditoria
+    # Auditoria (mesma transação da alteração: um único commit)
     evento = db.query(EventoAuditoria).filter_by(nome="excluir_associacao_usuario_ambiente").first()
     if evento:
         log = LogAuditoria(
@@ -304,7 +276,7 @@ def excluir_associacao(
             detalhes={"id_amb": id_amb, "id_con": id_con}
         )
         db.add(log)
-        db.commit()
+    db.commit()
     
     return
 
@@ -332,7 +304,7 @@ def reativar_associacao(
       - 200: Associação reativada com sucesso
       - 404: Associação não encontrada, já ativa, ou não pode ser reativada (ambiente/usuário inativo)
     """
-    vinculo = usuarios_ambientes_crud.reativar_associacao(db, id_con, id_amb)
+    vinculo = usuarios_ambientes_crud.reativar_associacao(db, id_con, id_amb, commit=False)
     
     if not vinculo:
         exc = HTTPException(
@@ -342,7 +314,7 @@ def reativar_associacao(
         exc.code = "associacao_not_found_or_cannot_reactivate"
         raise exc
     
-    # Auditoria
+    # Auditoria (mesma transação da alteração: um único commit)
     evento = db.query(EventoAuditoria).filter_by(nome="reativar_associacao_usuario_ambiente").first()
     if evento:
         log = LogAuditoria(
@@ -352,7 +324,7 @@ def reativar_associacao(
             detalhes={"id_amb": id_amb, "id_con": id_con}
         )
         db.add(log)
-        db.commit()
+    db.commit()
     
     return {
         "message": "Associação reativada com sucesso.",
@@ -1,17 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Body
+from sqlalchemy import select, exists, func
 from sqlalchemy.orm import Session
 from app.db.database import get_db
 from app.services.auth_service import require_admin
 from app.schemas.auth_schema import CadastroPermitidoCreate, CadastroPermitidoOut
 from app.crud import cadastro_permitido_crud
 from app.db import models
-from datetime import datetime, timezone
-from app.db.models import EventoAuditoria, LogAuditoria
+from app.services.auditoria_service import registrar_log_auditoria
 
 router = APIRouter(prefix="/whitelist", tags=["Whitelist"])
 
 @router.post("/", status_code=201)
 def cadastrar_email_permitido(
+    background_tasks: BackgroundTasks,
     cadastro: CadastroPermitidoCreate = Body(...),
     admin: models.Usuario = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -29,35 +30,42 @@ def cadastrar_email_permitido(
       - 201: Cadastro permitido criado
       - 400/409/422/500: Erros de validação ou negócio
     """
-    if db.query(models.Usuario).filter(models.Usuario.email == cadastro.email).first():
+    # As três verificações prévias numa única consulta (uma ida ao banco)
+    usuario_existe, ja_permitido, tipo_valido = db.execute(
+        select(
+            exists().where(func.lower(models.Usuario.email) == cadastro.email.lower()),
+            exists().where(
+                models.CadastroPermitido.email == cadastro.email,
+                models.CadastroPermitido.ativo == True
+            ),
+            exists().where(models.TipoUsuario.id_tipo == cadastro.id_tipo)
+        )
+    ).one()
+    if usuario_existe:
         exc = HTTPException(status_code=400, detail="Este email já está cadastrado como usuário. Não é possível permitir novo cadastro.")
         exc.code = "email_already_registered"
         raise exc
-    if cadastro_permitido_crud.get_cadastro_permitido_by_email(db, cadastro.email):
+    if ja_permitido:
         exc = HTTPException(status_code=409, detail="Este email já está na whitelist. Não é possível cadastrar novamente.")
         exc.code = "email_already_permitted"
         raise exc
-    tipo = db.query(models.TipoUsuario).filter(models.TipoUsuario.id_tipo == cadastro.id_tipo).first()
-    if not tipo:
+    if not tipo_valido:
         exc = HTTPException(status_code=422, detail="Tipo de usuário informado é inválido. Verifique o id_tipo enviado.")
         exc.code = "invalid_user_type"
         raise exc
     novo = cadastro_permitido_crud.create_cadastro_permitido(db, cadastro.email, cadastro.id_tipo, admin.administrador.id_adm)
     if not novo:
-        exc = HTTPException(status_code=500, detail="Erro interno: não foi possível cadastrar o email. Tente novamente ou contate o suporte.")
-        exc.code = "internal_error"
+        # Violação da UNIQUE de cadastros_permitidos.email (cadastro concorrente ou e-mail inativo na whitelist)
+        exc = HTTPException(status_code=409, detail="Este email já está na whitelist. Não é possível cadastrar novamente.")
+        exc.code = "email_already_permitted"
         raise exc
-    # Auditoria
-    evento = db.query(EventoAuditoria).filter_by(nome="cadastrar_email_permitido").first()
-    if evento:
-        log = LogAuditoria(
-            id_usu=admin.id_usu,
-            evento_id=evento.id_evento,
-            data_evento=datetime.now(timezone.utc),
-            detalhes={"id_cad": str(novo.id_cad), "email": novo.email}
-        )
-        db.add(log)
-        db.commit()
+    # Auditoria em segundo plano (o cadastro já foi confirmado pelo CRUD)
+    background_tasks.add_task(
+        registrar_log_auditoria,
+        admin.id_usu,
+        "cadastrar_email_permitido",
+        {"id_cad": str(novo.id_cad), "email": novo.email}
+    )
     return {"id_cad": str(novo.id_cad), "email": novo.email, "id_tipo": novo.id_tipo, "id_adm": str(novo.id_adm), "data_criado": novo.data_criado}
 
 @router.get("/", response_model=list[CadastroPermitidoOut])
@@ -91,7 +99,7 @@ def listar_cadastros_permitidos(
     return result
 
 @router.delete("/{id_cad}", status_code=204)
-def excluir_cadastro_permitido_route(id_cad: str, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
+def excluir_cadastro_permitido_route(id_cad: str, background_tasks: BackgroundTasks, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
     """
     Realiza a exclusão lógica (desativação) de um e-mail da Whitelist pelo ID.
 
@@ -105,21 +113,12 @@ def excluir_cadastro_permitido_route(id_cad: str, admin: models.Usuario = Depend
         exc = HTTPException(status_code=404, detail="Cadastro permitido não encontrado ou já inativo.")
         exc.code = "cadastro_not_found"
         raise exc
-    # Auditoria
-    evento = db.query(EventoAuditoria).filter_by(nome="excluir_cadastro_permitido").first()
-    if evento:
-        log = LogAuditoria(
-            id_usu=admin.id_usu,
-            evento_id=evento.id_evento,
-            data_evento=datetime.now(timezone.utc),
-            detalhes={"id_cad": id_cad}
-        )
-        db.add(log)
-        db.commit()
+    # Auditoria em segundo plano (a alteração já foi confirmada pelo CRUD)
+    background_tasks.add_task(registrar_log_auditoria, admin.id_usu, "excluir_cadastro_permitido", {"id_cad": id_cad})
     return
 
 @router.patch("/{id_cad}/reativar", status_code=200)
-def reativar_cadastro_permitido_route(id_cad: str, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
+def reativar_cadastro_permitido_route(id_cad: str, background_tasks: BackgroundTasks, admin: models.Usuario = Depends(require_admin), db: Session = Depends(get_db)):
     """
     Reativa um e-mail desativado na Whitelist pelo ID.
 
@@ -133,15 +132,6 @@ def reativar_cadastro_permitido_route(id_cad: str, admin: models.Usuario = Depen
         exc = HTTPException(status_code=404, detail="Cadastro permitido não encontrado ou já ativo.")
         exc.code = "cadastro_not_found"
         raise exc
-    # Auditoria
-    evento = db.query(EventoAuditoria).filter_by(nome="reativar_cadastro_permitido").first()
-    if evento:
-        log = LogAuditoria(
-            id_usu=admin.id_usu,
-            evento_id=evento.id_evento,
-            data_evento=datetime.now(timezone.utc),
-            detalhes={"id_cad": id_cad}
-        )
-        db.add(log)
-        db.commit()
+    # Auditoria em segundo plano (a alteração já foi confirmada pelo CRUD)
+    background_tasks.add_task(registrar_log_auditoria, admin.id_usu, "reativar_cadastro_permitido", {"id_cad": id_cad})
     return {"message": "Cadastro permitido reativado com sucesso."} 
\ No newline at end of file
@@ -2,36 +2,30 @@
 Utilitários para gerenciamento de timezone.
 """
 from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
 from zoneinfo import ZoneInfo
-from typing import Optional
 import logging
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
-# Cache do timezone
-_cached_timezone: Optional[ZoneInfo] = None
-
-
+@lru_cache(maxsize=1)
 def get_timezone() -> ZoneInfo:
     """
     Obtém o timezone configurado (padrão: America/Sao_Paulo - Brasília).
+    Resolvido uma única vez e memorizado (lru_cache).
     
     Returns:
         ZoneInfo com o timezone configurado
     """
-    global _cached_timezone
-    
-    if _cached_timezone is None:
-        try:
-            _cached_timezone = ZoneInfo(settings.TIMEZONE)
-            logger.info(f"🌍 Timezone configurado: {settings.TIMEZONE}")
-        except Exception as e:
-            logger.warning(f"⚠️ Erro ao configurar timezone {settings.TIMEZONE}, usando UTC: {e}")
-            _cached_timezone = dt_timezone.utc
-    
-    return _cached_timezone
+    try:
+        tz = ZoneInfo(settings.TIMEZONE)
+        logger.info(f"🌍 Timezone configurado: {settings.TIMEZONE}")
+        return tz
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao configurar timezone {settings.TIMEZONE}, usando UTC: {e}")
+        return dt_timezone.utc
 
 
 def now() -> datetime:
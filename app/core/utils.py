@@ -1,26 +1,47 @@
 import bcrypt
+import uuid
+from operator import mul
+from typing import Optional
 
-# Gera um hash seguro para a senha
+from app.core.config import settings
+
+# Gera um hash seguro para a senha (custo configurável via BCRYPT_ROUNDS)
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)).decode('utf-8')
 
 # Verifica se a senha corresponde ao hash
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def coerce_uuid(valor) -> Optional[uuid.UUID]:
+    """Converte um ID (UUID ou string) para UUID; retorna None se inválido.
+    IDs que já chegam como UUID (parâmetros tipados nas rotas) são devolvidos sem nova conversão."""
+    if isinstance(valor, uuid.UUID):
+        return valor
+    try:
+        return uuid.UUID(valor)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+# Pesos dos dígitos verificadores do CPF (1º DV sobre 9 dígitos, 2º DV sobre 10)
+_PESOS_DV1 = (10, 9, 8, 7, 6, 5, 4, 3, 2)
+_PESOS_DV2 = (11, 10, 9, 8, 7, 6, 5, 4, 3, 2)
+# Tabela de tradução b'0'..b'9' -> 0..9: converte os dígitos em C (bytes.translate), sem laço Python
+_DIGITOS_CPF = bytes.maketrans(b'0123456789', bytes(range(10)))
+
 def validar_cpf(cpf: str) -> bool:
     """Valida CPF (apenas números, 11 dígitos, algoritmo de validação)."""
-    cpf = ''.join(filter(str.isdigit, cpf))
-    if len(cpf) != 11 or cpf == cpf[0] * 11:
+    # Caminho rápido: CPF já só com dígitos dispensa a limpeza de máscara (pontos/traço)
+    if len(cpf) != 11 or not cpf.isdigit():
+        cpf = ''.join(filter(str.isdigit, cpf))
+    if len(cpf) != 11 or not cpf.isascii() or cpf == cpf[0] * 11:
+        return False
+    d = cpf.encode('ascii').translate(_DIGITOS_CPF)
+    if d[9] != (sum(map(mul, d, _PESOS_DV1)) * 10 % 11) % 10:
         return False
-    for i in range(9, 11):
-        soma = sum(int(cpf[num]) * ((i+1) - num) for num in range(0, i))
-        digito = ((soma * 10) % 11) % 10
-        if int(cpf[i]) != digito:
-            return False
-    return True
+    return d[10] == (sum(map(mul, d, _PESOS_DV2)) * 10 % 11) % 10
 
 def validar_nome(nome: str) -> bool:
     """Valida nome completo (mínimo 2 palavras, cada uma com pelo menos 2 letras)."""
@@ -31,7 +52,17 @@ def validar_forca_senha(senha: str) -> bool:
     """Valida força mínima da senha (mínimo 8 caracteres, 1 maiúscula, 1 minúscula, 1 número)."""
     if len(senha) < 8:
         return False
-    tem_maiuscula = any(c.isupper() for c in senha)
-    tem_minuscula = any(c.islower() for c in senha)
-    tem_numero = any(c.isdigit() for c in senha)
-    return tem_maiuscula and tem_minuscula and tem_numero 
\ No newline at end of file
+    # Uma única passada acumulando flags: 1 = maiúscula, 2 = minúscula, 4 = número
+    flags = 0
+    for c in senha:
+        if c.isupper():
+            flags |= 1
+        elif c.islower():
+            flags |= 2
+        elif c.isdigit():
+            flags |= 4
+        else:
+            continue
+        if flags == 7:
+            return True
+    return False 
\ No newline at end of file
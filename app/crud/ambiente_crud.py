@@ -1,12 +1,15 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, insert, update, select, values, column, literal, true, DateTime
+from sqlalchemy.dialects.postgresql import UUID
 from app.db import models
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
 from typing import List, Optional, Dict
 from app.db.models import Imagem, AmbienteConjuntoImagens, UsuarioAmbiente, Opcao
+from app.core.utils import coerce_uuid
 import uuid
 
+
 def obter_imagens_preview_ambiente(db, id_amb: str, limit: int = 5):
     """Retorna algumas imagens reais do ambiente para o Admin visualizar no Preview (mesmo inativo)"""
     imagens = db.query(models.Imagem).join(
@@ -57,87 +60,81 @@ def criar_ambiente(db: Session, titulo_amb: str, titulo_questionario: Optional[s
     if not opcoes or len(opcoes) < 2:
         return None, []
     
-    # Validar e limpar textos de opções (remover espaços, verificar não vazios)
-    opcoes_validas = []
+    # Validar, limpar (remover espaços, descartar vazias/longas) e remover duplicatas das opções
+    # numa única passada, mantendo a ordem de envio
+    vistas = set()
+    opcoes_unicas = []
     for texto in opcoes:
         texto_limpo = texto.strip() if texto else ""
-        if texto_limpo and len(texto_limpo) <= 255:
-            opcoes_validas.append(texto_limpo)
+        if not texto_limpo or len(texto_limpo) > 255 or texto_limpo in vistas:
+            continue
+        vistas.add(texto_limpo)
+        opcoes_unicas.append(texto_limpo)
     
-    # Se após validação tiver menos de 2 opções válidas, retornar erro
-    if len(opcoes_validas) < 2:
+    # Se após validação tiver menos de 2 opções válidas (distintas), retornar erro
+    if len(opcoes_unicas) < 2:
         return None, []
     
-    # Remover duplicatas mantendo ordem
-    ids_conjuntos_unicos = list(dict.fromkeys(ids_conjuntos))
-    opcoes_unicas = list(dict.fromkeys(opcoes_validas))
+    # Converter para UUID antes de remover duplicatas (mantendo ordem): grafias diferentes
+    # do mesmo UUID (ex.: maiúsculas) viram um único conjunto
+    ids_uuid = list(dict.fromkeys(coerce_uuid(id_cnj) for id_cnj in ids_conjuntos))
     
     # Validar que todos os IDs de conjuntos existem no banco (em uma única query)
-    try:
-        ids_uuid = [uuid.UUID(id_cnj) for id_cnj in ids_conjuntos_unicos]
-    except ValueError:
+    if None in ids_uuid:
         # IDs inválidos (não são UUIDs válidos)
         return None, []
     
-    conjuntos_validos = db.query(models.ConjuntoImagens).filter(
-        models.ConjuntoImagens.id_cnj.in_(ids_uuid)
-    ).all()
-    
-    ids_validos_encontrados = {str(cnj.id_cnj) for cnj in conjuntos_validos}
-    ids_solicitados = set(ids_conjuntos_unicos)
+    # Apenas os IDs (tuplas), sem hidratar objetos ConjuntoImagens
+    ids_validos_encontrados = {
+        id_cnj for (id_cnj,) in db.query(models.ConjuntoImagens.id_cnj).filter(
+            models.ConjuntoImagens.id_cnj.in_(ids_uuid)
+        ).all()
+    }
     
     # Se algum ID não foi encontrado, retornar erro
-    if ids_validos_encontrados != ids_solicitados:
+    if ids_validos_encontrados != set(ids_uuid):
         return None, []
     
-    # Criar ambiente
-    novo = models.Ambiente(
+    agora = datetime.now(timezone.utc)
+    id_amb = uuid.uuid4()
+    
+    # Criar ambiente e associações com conjuntos numa única instrução:
+    # WITH novo_amb AS (INSERT INTO ambientes ... RETURNING id_amb)
+    # INSERT INTO ambientes_conjuntos_imagens SELECT novo_amb.id_amb, cnj.id_cnj, ... FROM novo_amb JOIN (VALUES ...) cnj
+    novo_amb = insert(models.Ambiente).values(
+        id_amb=id_amb,
         titulo_amb=titulo_amb,
         titulo_questionario=titulo_questionario.strip() if titulo_questionario else None,
         descricao_questionario=descricao_questionario,
         multipla_escolha=multipla_escolha,
-        data_criado=datetime.now(timezone.utc),
+        data_criado=agora,
         id_adm=id_adm,
-        ativo=True
-    )
-    db.add(novo)
+        ativo=True,
+        utilizavel=True
+    ).returning(models.Ambiente.id_amb).cte("novo_amb")
+    conjuntos = values(
+        column("id_cnj", UUID(as_uuid=True)), name="cnj"
+    ).data([(id_cnj_uuid,) for id_cnj_uuid in ids_uuid])
     
     try:
-        db.flush()  # Obter ID do ambiente sem fazer commit
-        data_associado = datetime.now(timezone.utc)
-        
-        # Criar associações na tabela auxiliar
-        for id_cnj_uuid in ids_uuid:
-            associacao = models.AmbienteConjuntoImagens(
-                id_amb=novo.id_amb,
-                id_cnj=id_cnj_uuid,
-                data_associado=data_associado,
-                ativo=True
+        db.execute(
+            insert(models.AmbienteConjuntoImagens).from_select(
+                ["id_amb", "id_cnj", "data_associado", "ativo"],
+                select(novo_amb.c.id_amb, conjuntos.c.id_cnj, literal(agora, DateTime(timezone=True)), true())
+                .select_from(novo_amb.join(conjuntos, true()))
             )
-            db.add(associacao)
+        )
         
-        # Criar opções (garantir atomicidade - se falhar, rollback completo)
-        for texto_opcao in opcoes_unicas:
-            # Verificar se já existe opção com mesmo texto no mesmo ambiente
-            opcao_existente = db.query(models.Opcao).filter_by(
-                id_amb=novo.id_amb,
-                texto=texto_opcao
-            ).first()
-            
-            if opcao_existente:
-                # Se já existe, fazer rollback e retornar erro
-                db.rollback()
-                return None, []
-            
-            nova_opcao = models.Opcao(
-                texto=texto_opcao,
-                id_amb=novo.id_amb
-            )
-            db.add(nova_opcao)
+        # Criar opções num único INSERT multi-valores (mesma transação - se falhar, rollback completo).
+        # O ambiente acabou de ser criado e opcoes_unicas já está sem repetições, então não há
+        # opção pré-existente com o mesmo texto a verificar.
+        db.execute(insert(models.Opcao).values([
+            {"id_opc": uuid.uuid4(), "texto": texto_opcao, "id_amb": id_amb}
+            for texto_opcao in opcoes_unicas
+        ]))
         
         db.commit()
-        db.refresh(novo)
-        return novo, ids_conjuntos_unicos
+        return db.get(models.Ambiente, id_amb), [str(id_cnj) for id_cnj in ids_uuid]
     except IntegrityError:
         db.rollback()
         return None, []
@@ -147,8 +144,15 @@ def criar_ambiente(db: Session, titulo_amb: str, titulo_questionario: Optional[s
 
 
 def listar_ambientes(db: Session):
-    """Lista todos os ambientes."""
-    return db.query(models.Ambiente).all()
+    """
+    Lista todos os ambientes.
+    Administrador (e seu usuário) e associações com conjuntos vêm em lote (consultas IN),
+    evitando N+1 ao montar a resposta da listagem.
+    """
+    return db.query(models.Ambiente).options(
+        selectinload(models.Ambiente.administrador).selectinload(models.UsuarioAdministrador.usuario),
+        selectinload(models.Ambiente.conjuntos_imagens)
+    ).all()
 
 
 def buscar_ambiente_por_titulo(db: Session, titulo_amb: str):
@@ -158,11 +162,10 @@ def buscar_ambiente_por_titulo(db: Session, titulo_amb: str):
 
 def buscar_ambiente_por_id(db: Session, id_amb):
     """Busca ambiente por ID."""
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-        return db.query(models.Ambiente).filter(models.Ambiente.id_amb == id_amb_uuid).first()
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
+    return db.get(models.Ambiente, id_amb_uuid)
 
 
 def excluir_ambiente(db: Session, id_amb):
@@ -176,37 +179,30 @@ def excluir_ambiente(db: Session, id_amb):
     Returns:
         Ambiente excluído ou None se não encontrado
     """
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
     
-    ambiente = db.query(models.Ambiente).filter(
-        models.Ambiente.id_amb == id_amb_uuid,
-        models.Ambiente.ativo == True
-    ).first()
+    # Excluir logicamente o ambiente direto com UPDATE ... RETURNING (sem SELECT prévio)
+    ambiente = db.execute(
+        update(models.Ambiente).where(
+            models.Ambiente.id_amb == id_amb_uuid,
+            models.Ambiente.ativo == True
+        ).values(ativo=False).returning(models.Ambiente)
+    ).scalars().first()
     
     if ambiente:
-        # Excluir logicamente o ambiente
-        ambiente.ativo = False
-        
-        # Excluir logicamente todas as associações com conjuntos em cascata
-        associacoes_conjuntos = db.query(models.AmbienteConjuntoImagens).filter(
+        # Excluir logicamente todas as associações com conjuntos em cascata (UPDATE em lote)
+        db.query(models.AmbienteConjuntoImagens).filter(
             models.AmbienteConjuntoImagens.id_amb == id_amb_uuid,
             models.AmbienteConjuntoImagens.ativo == True
-        ).all()
+        ).update({"ativo": False}, synchronize_session=False)
         
-        for associacao in associacoes_conjuntos:
-            associacao.ativo = False
-        
-        # Excluir logicamente todas as associações com usuários em cascata
-        associacoes_usuarios = db.query(models.UsuarioAmbiente).filter(
+        # Excluir logicamente todas as associações com usuários em cascata (UPDATE em lote)
+        db.query(models.UsuarioAmbiente).filter(
             models.UsuarioAmbiente.id_amb == id_amb_uuid,
             models.UsuarioAmbiente.ativo == True
-        ).all()
-        
-        for associacao in associacoes_usuarios:
-            associacao.ativo = False
+        ).update({"ativo": False}, synchronize_session=False)
         
         db.commit()
     
@@ -228,9 +224,8 @@ def reativar_ambiente(db: Session, id_amb):
     Returns:
         Ambiente reativado ou None se não encontrado ou se não foi possível reativar
     """
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
     
     ambiente = db.query(models.Ambiente).filter(
@@ -241,49 +236,25 @@ def reativar_ambiente(db: Session, id_amb):
     if not ambiente:
         return None
     
-    # Buscar todas as associações inativas deste ambiente (conjuntos e usuários)
-    associacoes_conjuntos = db.query(models.AmbienteConjuntoImagens).filter(
+    # Reativar, num único UPDATE, as associações inativas com conjuntos que ainda existem no NextCloud
+    associacoes_conjuntos_reativadas = db.query(models.AmbienteConjuntoImagens).filter(
         models.AmbienteConjuntoImagens.id_amb == id_amb_uuid,
-        models.AmbienteConjuntoImagens.ativo == False
-    ).all()
+        models.AmbienteConjuntoImagens.ativo == False,
+        models.AmbienteConjuntoImagens.id_cnj.in_(
+            select(models.ConjuntoImagens.id_cnj).where(models.ConjuntoImagens.existe_no_nextcloud == True)
+        )
+    ).update({"ativo": True}, synchronize_session=False)
     
-    associacoes_usuarios = db.query(models.UsuarioAmbiente).filter(
+    # Reativar, num único UPDATE, as associações inativas com usuários convencionais ainda ativos
+    associacoes_usuarios_reativadas = db.query(models.UsuarioAmbiente).filter(
         models.UsuarioAmbiente.id_amb == id_amb_uuid,
-        models.UsuarioAmbiente.ativo == False
-    ).all()
-    
-    if not associacoes_conjuntos and not associacoes_usuarios:
-        # Não há associações para reativar
-        return None
-    
-    # Verificar quais conjuntos ainda existem no NextCloud
-    associacoes_conjuntos_reativadas = 0
-    if associacoes_conjuntos:
-        ids_conjuntos = [assoc.id_cnj for assoc in associacoes_conjuntos]
-        conjuntos_validos = db.query(models.ConjuntoImagens).filter(
-            models.ConjuntoImagens.id_cnj.in_(ids_conjuntos),
-            models.ConjuntoImagens.existe_no_nextcloud == True
-        ).all()
-        
-        ids_conjuntos_validos = {cnj.id_cnj for cnj in conjuntos_validos}
-        
-        # Reativar apenas as associações com conjuntos válidos
-        for associacao in associacoes_conjuntos:
-            if associacao.id_cnj in ids_conjuntos_validos:
-                associacao.ativo = True
-                associacoes_conjuntos_reativadas += 1
-    
-    # Reativar associações com usuários (verificar se usuários ainda estão ativos)
-    associacoes_usuarios_reativadas = 0
-    for associacao in associacoes_usuarios:
-        # Verificar se o usuário convencional ainda está ativo
-        usuario_conv = db.query(models.UsuarioConvencional).filter_by(
-            id_con=associacao.id_con
-        ).first()
-        
-        if usuario_conv and usuario_conv.usuario.ativo:
-            associacao.ativo = True
-            associacoes_usuarios_reativadas += 1
+        models.UsuarioAmbiente.ativo == False,
+        models.UsuarioAmbiente.id_con.in_(
+            select(models.UsuarioConvencional.id_con).join(
+                models.Usuario, models.Usuario.id_usu == models.UsuarioConvencional.id_usu
+            ).where(models.Usuario.ativo == True)
+        )
+    ).update({"ativo": True}, synchronize_session=False)
     
     # Reativar ambiente apenas se pelo menos uma associação (conjunto ou usuário) foi reativada
     if associacoes_conjuntos_reativadas > 0 or associacoes_usuarios_reativadas > 0:
@@ -305,9 +276,8 @@ def obter_conjuntos_do_ambiente(db: Session, id_amb):
     Returns:
         Lista de IDs de conjuntos (strings)
     """
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return []
     
     associacoes = db.query(models.AmbienteConjuntoImagens).filter(
@@ -366,24 +336,25 @@ def atualizar_titulo_ambiente(db: Session, id_amb: str, novo_titulo: str) -> Opt
     if not titulo_limpo or len(titulo_limpo) < 3 or len(titulo_limpo) > 255:
         return None
     
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
     
     # Buscar ambiente
-    ambiente = db.query(models.Ambiente).filter_by(id_amb=id_amb_uuid).first()
+    ambiente = db.get(models.Ambiente, id_amb_uuid)
     
     if not ambiente:
         return None
     
-    # Verificar se novo título já existe em outro ambiente
-    ambiente_existente = db.query(models.Ambiente).filter(
-        models.Ambiente.titulo_amb == titulo_limpo,
-        models.Ambiente.id_amb != id_amb_uuid
-    ).first()
+    # Verificar se novo título já existe em outro ambiente (SELECT EXISTS: não traz colunas do ambiente)
+    titulo_em_uso = db.query(
+        db.query(models.Ambiente).filter(
+            models.Ambiente.titulo_amb == titulo_limpo,
+            models.Ambiente.id_amb != id_amb_uuid
+        ).exists()
+    ).scalar()
     
-    if ambiente_existente:
+    if titulo_em_uso:
         return None
     
     # Atualizar título
@@ -391,7 +362,6 @@ def atualizar_titulo_ambiente(db: Session, id_amb: str, novo_titulo: str) -> Opt
     
     try:
         db.commit()
-        db.refresh(ambiente)
         return ambiente
     except IntegrityError:
         db.rollback()
@@ -423,13 +393,12 @@ def atualizar_descricao_questionario(db: Session, id_amb: str, nova_descricao: s
     if not descricao_limpa or len(descricao_limpa) < 3:
         return None
     
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
     
     # Buscar ambiente
-    ambiente = db.query(models.Ambiente).filter_by(id_amb=id_amb_uuid).first()
+    ambiente = db.get(models.Ambiente, id_amb_uuid)
     
     if not ambiente:
         return None
@@ -439,7 +408,6 @@ def atualizar_descricao_questionario(db: Session, id_amb: str, nova_descricao: s
     
     try:
         db.commit()
-        db.refresh(ambiente)
         return ambiente
     except Exception as e:
         db.rollback()
@@ -472,13 +440,12 @@ def atualizar_titulo_questionario(db: Session, id_amb: str, novo_titulo: Optiona
                 return None
             titulo_limpo = titulo_temp
     
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
     
     # Buscar ambiente
-    ambiente = db.query(models.Ambiente).filter_by(id_amb=id_amb_uuid).first()
+    ambiente = db.get(models.Ambiente, id_amb_uuid)
     
     if not ambiente:
         return None
@@ -488,7 +455,6 @@ def atualizar_titulo_questionario(db: Session, id_amb: str, novo_titulo: Optiona
     
     try:
         db.commit()
-        db.refresh(ambiente)
         return ambiente
     except Exception as e:
         db.rollback()
@@ -1,9 +1,18 @@
 from sqlalchemy.orm import Session
 from app.db.models import LogAuditoria, EventoAuditoria, Usuario
-from sqlalchemy import and_, desc
+from sqlalchemy import and_, desc, func, tuple_
 from typing import Optional
+from datetime import datetime
+import uuid
 
-def listar_logs(db: Session, page: int = 1, page_size: int = 50, id_usuario: Optional[str] = None, id_evento: Optional[int] = None, data_inicio: Optional[str] = None, data_fim: Optional[str] = None):
+def listar_logs(db: Session, page: int = 1, page_size: int = 50, id_usuario: Optional[str] = None, id_evento: Optional[int] = None, data_inicio: Optional[str] = None, data_fim: Optional[str] = None, cursor_data_evento: Optional[datetime] = None, cursor_id: Optional[uuid.UUID] = None):
+    """
+    Lista logs do mais recente para o mais antigo. Retorna (logs, total, tem_mais).
+
+    Com cursor (data_evento, id_log do último log da página anterior), usa paginação keyset:
+    WHERE (data_evento, id_log) < cursor, sem OFFSET (custo constante em qualquer página).
+    Sem cursor, mantém a paginação por page/OFFSET.
+    """
     query = db.query(LogAuditoria)
     if id_usuario:
         query = query.filter(LogAuditoria.id_usu == id_usuario)
@@ -13,10 +22,24 @@ def listar_logs(db: Session, page: int = 1, page_size: int = 50, id_usuario: Opt
         query = query.filter(LogAuditoria.data_evento >= data_inicio)
     if data_fim:
         query = query.filter(LogAuditoria.data_evento <= data_fim)
-    total = query.count()
-    query = query.order_by(desc(LogAuditoria.data_evento))
-    logs = query.offset((page - 1) * page_size).limit(page_size).all()
-    return logs, total
+    # id_log desempata logs com o mesmo data_evento (ordem estável entre páginas)
+    ordem = (desc(LogAuditoria.data_evento), desc(LogAuditoria.id_log))
+    if cursor_data_evento is not None and cursor_id is not None:
+        # Total sobre os filtros sem o cursor (subconsulta escalar na mesma ida ao banco)
+        total_sq = query.with_entities(func.count()).scalar_subquery()
+        paginada = query.filter(
+            tuple_(LogAuditoria.data_evento, LogAuditoria.id_log) < tuple_(cursor_data_evento, cursor_id)
+        ).add_columns(total_sq.label("total")).order_by(*ordem)
+    else:
+        # Total via COUNT(*) OVER (): página e total na mesma consulta (uma ida ao banco)
+        paginada = query.add_columns(func.count().over().label("total")).order_by(*ordem).offset((page - 1) * page_size)
+    # page_size + 1: a linha extra indica se existe próxima página
+    rows = paginada.limit(page_size + 1).all()
+    if rows:
+        return [row[0] for row in rows[:page_size]], rows[0].total, len(rows) > page_size
+    # Página além do fim (ou nenhum log): sem linhas, o total precisa de contagem própria
+    total = query.count() if page > 1 or cursor_id is not None else 0
+    return [], total, False
 
 def listar_eventos(db: Session):
     return db.query(EventoAuditoria).order_by(EventoAuditoria.id_evento).all() 
\ No newline at end of file
@@ -1,7 +1,10 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import insert, update
 from app.db import models
+from app.core.utils import coerce_uuid
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
+import uuid
 
 
 def get_cadastro_permitido_by_email(db: Session, email: str):
@@ -9,17 +12,25 @@ def get_cadastro_permitido_by_email(db: Session, email: str):
 
 
 def create_cadastro_permitido(db: Session, email: str, id_tipo: int, id_adm):
-    novo = models.CadastroPermitido(
+    # INSERT ... RETURNING: a linha devolvida já traz os campos da resposta (sem refresh/SELECT após o commit)
+    stmt = insert(models.CadastroPermitido).values(
+        id_cad=uuid.uuid4(),
         email=email,
         id_tipo=id_tipo,
         id_adm=id_adm,
         data_criado=datetime.now(timezone.utc),
-        usado=False
+        usado=False,
+        ativo=True
+    ).returning(
+        models.CadastroPermitido.id_cad,
+        models.CadastroPermitido.email,
+        models.CadastroPermitido.id_tipo,
+        models.CadastroPermitido.id_adm,
+        models.CadastroPermitido.data_criado
     )
-    db.add(novo)
     try:
+        novo = db.execute(stmt).one()
         db.commit()
-        db.refresh(novo)
         return novo
     except IntegrityError:
         db.rollback()
@@ -27,29 +38,46 @@ def create_cadastro_permitido(db: Session, email: str, id_tipo: int, id_adm):
 
 
 def list_cadastros_permitidos(db: Session):
-    return db.query(models.CadastroPermitido).all() 
+    # Carrega administrador e seu usuário em lote (2 consultas IN) para evitar N+1 na listagem
+    return db.query(models.CadastroPermitido).options(
+        selectinload(models.CadastroPermitido.administrador).selectinload(models.UsuarioAdministrador.usuario)
+    ).all()
 
 
-def marcar_cadastro_como_usado(db: Session, email: str):
-    cadastro = get_cadastro_permitido_by_email(db, email)
+def _atualizar_cadastro(db: Session, filtros, valores: dict):
+    # UPDATE ... WHERE ... RETURNING: busca e alteração num único comando atômico (sem SELECT prévio)
+    stmt = update(models.CadastroPermitido).where(*filtros).values(**valores).returning(models.CadastroPermitido)
+    cadastro = db.execute(stmt).scalars().first()
     if cadastro:
-        cadastro.usado = True
         db.commit()
-        db.refresh(cadastro)
-    return cadastro 
+    return cadastro
+
+
+def marcar_cadastro_como_usado(db: Session, email: str):
+    return _atualizar_cadastro(
+        db,
+        (models.CadastroPermitido.email == email, models.CadastroPermitido.ativo == True),
+        {"usado": True}
+    )
 
 
 def excluir_cadastro_permitido(db: Session, id_cad: int):
-    cadastro = db.query(models.CadastroPermitido).filter(models.CadastroPermitido.id_cad == id_cad, models.CadastroPermitido.ativo == True).first()
-    if cadastro:
-        cadastro.ativo = False
-        db.commit()
-    return cadastro
+    id_cad_uuid = coerce_uuid(id_cad)
+    if id_cad_uuid is None:
+        return None
+    return _atualizar_cadastro(
+        db,
+        (models.CadastroPermitido.id_cad == id_cad_uuid, models.CadastroPermitido.ativo == True),
+        {"ativo": False}
+    )
 
 
 def reativar_cadastro_permitido(db: Session, id_cad: int):
-    cadastro = db.query(models.CadastroPermitido).filter(models.CadastroPermitido.id_cad == id_cad, models.CadastroPermitido.ativo == False).first()
-    if cadastro:
-        cadastro.ativo = True
-        db.commit()
-    return cadastro 
\ No newline at end of file
+    id_cad_uuid = coerce_uuid(id_cad)
+    if id_cad_uuid is None:
+        return None
+    return _atualizar_cadastro(
+        db,
+        (models.CadastroPermitido.id_cad == id_cad_uuid, models.CadastroPermitido.ativo == False),
+        {"ativo": True}
+    ) 
\ No newline at end of file
@@ -1,85 +1,149 @@
 """
 CRUD para operações de classificação de imagens.
 """
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, aliased, raiseload, load_only
+from sqlalchemy import and_, tuple_, select, exists, values, column, literal, literal_column, true, case, String, DateTime, any_, bindparam
+from sqlalchemy.dialects.postgresql import UUID, ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app.db import models
+from app.core.config import settings
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
+import base64
+import binascii
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def obter_progresso_usuario(db: Session, id_con: str, id_amb: str) -> Optional[models.UsuarioAmbienteProgresso]:
+def obter_progresso_usuario(db: Session, id_con: uuid.UUID, id_amb: uuid.UUID, commit: bool = True) -> Optional[models.UsuarioAmbienteProgresso]:
     """
     Busca ou cria o progresso do usuário em um ambiente.
     
+    A busca é pela chave primária (db.get): chamadas repetidas na mesma sessão usam o identity map,
+    sem nova ida ao banco. A criação usa INSERT ... ON CONFLICT DO NOTHING, seguro contra requisições
+    concorrentes do mesmo usuário. Só a criação escreve (data_ultima_atividade vem do DEFAULT do banco);
+    a leitura não altera o progresso.
+    
     Args:
         db: Sessão do banco de dados
         id_con: ID do usuário convencional
         id_amb: ID do ambiente
+        commit: Se False, não confirma a criação (o chamador controla a transação)
     
     Returns:
         Objeto UsuarioAmbienteProgresso
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
-        return None
-    
-    progresso = db.query(models.UsuarioAmbienteProgresso).filter_by(
-        id_con=id_con_uuid,
-        id_amb=id_amb_uuid
-    ).first()
-    
-    if not progresso:
-        # Criar progresso inicial
-        progresso = models.UsuarioAmbienteProgresso(
-            id_con=id_con_uuid,
-            id_amb=id_amb_uuid,
+    progresso = db.get(models.UsuarioAmbienteProgresso, (id_con, id_amb))
+    if progresso:
+        return progresso
+    
+    # Criar progresso inicial (RETURNING devolve o objeto já na sessão, sem refresh)
+    progresso = db.scalars(
+        pg_insert(models.UsuarioAmbienteProgresso).values(
+            id_con=id_con,
+            id_amb=id_amb,
             ultimo_data_proc_processado=None,
             ultimo_content_hash_processado=None,
-            total_classificadas=0,
-            data_ultima_atividade=datetime.now(timezone.utc)
-        )
-        db.add(progresso)
+            total_classificadas=0
+        ).on_conflict_do_nothing(
+            index_elements=["id_con", "id_amb"]
+        ).returning(models.UsuarioAmbienteProgresso)
+    ).first()
+    if progresso is None:
+        # Criado por outra requisição entre a busca e o INSERT
+        progresso = db.get(models.UsuarioAmbienteProgresso, (id_con, id_amb))
+    if commit:
         db.commit()
-        db.refresh(progresso)
     
     return progresso
 
 
-def buscar_conjuntos_ambiente(db: Session, id_amb: str) -> List[uuid.UUID]:
+# Fora de produção, relacionamentos não declarados (selectinload/joinedload) nos objetos devolvidos às
+# rotas levantam erro em vez de disparar lazy loads silenciosos (N+1)
+_SEM_LAZY_LOAD = () if settings.ENV.lower() == "production" else (raiseload("*"),)
+
+
+def _colunas_pagina(imagem=models.Imagem):
     """
-    Busca IDs dos conjuntos associados a um ambiente.
-    
-    Args:
-        db: Sessão do banco de dados
-        id_amb: ID do ambiente
-    
-    Returns:
-        Lista de UUIDs dos conjuntos
+    Carrega só as colunas da imagem usadas na resposta paginada (e no cursor), deixando de fora
+    o JSONB de metadados. Fora de produção, acessar outra coluna levanta erro em vez de ir ao banco.
     """
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
-        return []
-    
-    associacoes = db.query(models.AmbienteConjuntoImagens).filter(
-        models.AmbienteConjuntoImagens.id_amb == id_amb_uuid,
+    return load_only(
+        imagem.content_hash,
+        imagem.nome_img,
+        imagem.caminho_img,
+        imagem.data_proc,
+        imagem.data_sinc,
+        imagem.id_cnj,
+        raiseload=bool(_SEM_LAZY_LOAD)
+    )
+
+
+def _conjuntos_ativos_ambiente(id_amb: uuid.UUID):
+    """Subconsulta com os IDs dos conjuntos ativos do ambiente (usada em id_cnj IN (...), resolvida no banco)."""
+    return select(models.AmbienteConjuntoImagens.id_cnj).where(
+        models.AmbienteConjuntoImagens.id_amb == id_amb,
         models.AmbienteConjuntoImagens.ativo == True
-    ).all()
-    
-    return [assoc.id_cnj for assoc in associacoes]
+    )
+
+
+# Textos das opções por id_opc, compartilhado entre requisições do processo. O texto de uma Opcao é
+# imutável e opções não são removidas (só em cascata com o ambiente), então não há o que invalidar;
+# a validação das opções escolhidas continua no banco (JOIN do UPSERT). As threads do pool usam o
+# dicionário sem lock: cada leitura é um único .get() e o resultado é montado num dicionário local,
+# então um .clear() concorrente só faz a opção ser buscada de novo no banco.
+_TEXTOS_OPCOES: Dict[uuid.UUID, str] = {}
+_TEXTOS_OPCOES_MAX = 10000
+
+
+def obter_textos_opcoes(db: Session, ids_opc: Iterable[uuid.UUID]) -> Dict[uuid.UUID, str]:
+    """
+    Retorna {id_opc: texto} para as opções informadas. Só as que ainda não estão em memória
+    são buscadas, numa única consulta.
+    """
+    textos = {}
+    faltando = []
+    for i in ids_opc:
+        texto = _TEXTOS_OPCOES.get(i)
+        if texto is None:
+            faltando.append(i)
+        else:
+            textos[i] = texto
+    if faltando:
+        buscados = dict(db.execute(
+            select(models.Opcao.id_opc, models.Opcao.texto).where(models.Opcao.id_opc.in_(faltando))
+        ).all())
+        if len(_TEXTOS_OPCOES) + len(buscados) > _TEXTOS_OPCOES_MAX:
+            _TEXTOS_OPCOES.clear()
+        _TEXTOS_OPCOES.update(buscados)
+        textos.update(buscados)
+    return textos
+
+
+def codificar_cursor(id_cnj: uuid.UUID, data_proc: datetime, content_hash: str) -> str:
+    """
+    Cursor opaco de paginação (base64 de "id_cnj|data_proc|content_hash"), devolvido ao cliente.
+    Tem as mesmas colunas da ordenação das páginas (id_cnj, data_proc, content_hash).
+    """
+    return base64.urlsafe_b64encode(f"{id_cnj}|{data_proc.isoformat()}|{content_hash}".encode()).decode()
+
+
+def decodificar_cursor(cursor: str) -> Optional[Tuple[uuid.UUID, datetime, str]]:
+    """Converte o cursor opaco em (id_cnj, data_proc, content_hash); retorna None se inválido."""
+    try:
+        id_cnj, data_proc, content_hash = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return uuid.UUID(id_cnj), datetime.fromisoformat(data_proc), content_hash
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
 
 
 def buscar_imagens_inicial(
     db: Session,
-    id_amb: str,
-    id_con: str,
+    id_amb: uuid.UUID,
+    id_con: uuid.UUID,
     limit: int = 20
 ) -> Tuple[List[models.Imagem], bool]:
     """
@@ -94,52 +158,43 @@ def buscar_imagens_inicial(
     Returns:
         Tupla (lista_imagens, tem_mais)
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-    except (ValueError, TypeError):
-        return [], False
-    
     # Buscar progresso
     progresso = obter_progresso_usuario(db, id_con, id_amb)
     if not progresso:
         return [], False
     
-    # Buscar conjuntos do ambiente
-    conjuntos_ids = buscar_conjuntos_ambiente(db, id_amb)
-    if not conjuntos_ids:
-        return [], False
-    
-    # Buscar imagens já classificadas pelo usuário (apenas classificações ativas)
-    classificadas_subquery = db.query(models.Classificacao.id_img).filter(
-        models.Classificacao.id_con == id_con_uuid,
+    # Conjuntos ativos do ambiente entram como subconsulta: tudo é resolvido no banco, numa única consulta de imagens
+    conjuntos_subquery = _conjuntos_ativos_ambiente(id_amb)
+    # Imagem já classificada pelo usuário (apenas classificações ativas): NOT EXISTS correlacionado,
+    # resolvido por busca no índice parcial (id_con, id_img) WHERE ativo para cada imagem candidata
+    classificada = exists().where(
+        models.Classificacao.id_con == id_con,
+        models.Classificacao.id_img == models.Imagem.content_hash,
         models.Classificacao.ativo == True
-    ).distinct()
-    classificadas_hashes = [row[0] for row in classificadas_subquery.all()]
+    )
     
-    # Query base
+    # Query base (sem imagens já classificadas)
     query = db.query(models.Imagem).filter(
-        models.Imagem.id_cnj.in_(conjuntos_ids),
-        models.Imagem.existe_no_nextcloud == True
+        models.Imagem.id_cnj.in_(conjuntos_subquery),
+        models.Imagem.existe_no_nextcloud == True,
+        ~classificada
     )
     
-    # Filtrar imagens já classificadas
-    if classificadas_hashes:
-        query = query.filter(~models.Imagem.content_hash.in_(classificadas_hashes))
-    
     # Se há progresso, buscar a partir do cursor
     if progresso.ultimo_data_proc_processado and progresso.ultimo_content_hash_processado:
+        # O progresso não guarda o conjunto da última imagem: ele vem de uma subconsulta pela chave primária
+        id_cnj_ultima = select(models.Imagem.id_cnj).where(
+            models.Imagem.content_hash == progresso.ultimo_content_hash_processado
+        ).scalar_subquery()
         query = query.filter(
-            or_(
-                models.Imagem.data_proc > progresso.ultimo_data_proc_processado,
-                and_(
-                    models.Imagem.data_proc == progresso.ultimo_data_proc_processado,
-                    models.Imagem.content_hash > progresso.ultimo_content_hash_processado
-                )
+            # Comparação de linha (row value) nas colunas da ordenação: vira condição do índice idx_imagem_keyset
+            tuple_(models.Imagem.id_cnj, models.Imagem.data_proc, models.Imagem.content_hash) > tuple_(
+                id_cnj_ultima, progresso.ultimo_data_proc_processado, progresso.ultimo_content_hash_processado
             )
         )
     
     # Ordenar e limitar
-    imagens = query.order_by(
+    imagens = query.options(_colunas_pagina(), *_SEM_LAZY_LOAD).order_by(
         models.Imagem.id_cnj,
         models.Imagem.data_proc,
         models.Imagem.content_hash
@@ -154,10 +209,11 @@ def buscar_imagens_inicial(
 
 def buscar_imagens_avancar(
     db: Session,
-    id_amb: str,
-    id_con: str,
-    content_hash: str,
-    limit: int = 20
+    id_amb: uuid.UUID,
+    id_con: uuid.UUID,
+    content_hash: Optional[str],
+    limit: int = 20,
+    cursor: Optional[Tuple[uuid.UUID, datetime, str]] = None
 ) -> Tuple[List[models.Imagem], bool]:
     """
     Busca próximas imagens após uma imagem específica.
@@ -167,42 +223,30 @@ def buscar_imagens_avancar(
         db: Sessão do banco de dados
         id_amb: ID do ambiente
         id_con: ID do usuário convencional
-        content_hash: Hash da imagem atual
+        content_hash: Hash da imagem atual (usado quando não há cursor)
         limit: Quantidade de imagens a retornar
+        cursor: (id_cnj, data_proc, content_hash) decodificado do cursor do cliente; dispensa a busca da imagem de referência
     
     Returns:
         Tupla (lista_imagens, tem_mais)
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-    except (ValueError, TypeError):
-        return [], False
-    
-    # Buscar a imagem de referência
-    imagem_ref = db.query(models.Imagem).filter_by(content_hash=content_hash).first()
-    if not imagem_ref:
-        return [], False
-    
-    # Verificar se a imagem pertence ao ambiente
-    conjuntos_ids = buscar_conjuntos_ambiente(db, id_amb)
-    if imagem_ref.id_cnj not in conjuntos_ids:
-        return [], False
+    if cursor is None:
+        # Imagem de referência e pertinência ao ambiente numa única consulta
+        imagem_ref = buscar_imagem_no_ambiente(db, id_amb, content_hash)
+        if not imagem_ref or not imagem_ref.pertence:
+            return [], False
+        cursor = (imagem_ref.id_cnj, imagem_ref.data_proc, imagem_ref.content_hash)
     
     # Query para buscar próximas imagens
     query = db.query(models.Imagem).filter(
-        models.Imagem.id_cnj.in_(conjuntos_ids),
+        models.Imagem.id_cnj.in_(_conjuntos_ativos_ambiente(id_amb)),
         models.Imagem.existe_no_nextcloud == True,
-        or_(
-            models.Imagem.data_proc > imagem_ref.data_proc,
-            and_(
-                models.Imagem.data_proc == imagem_ref.data_proc,
-                models.Imagem.content_hash > imagem_ref.content_hash
-            )
-        )
+        # Comparação de linha (row value) nas colunas da ordenação: vira condição do índice idx_imagem_keyset
+        tuple_(models.Imagem.id_cnj, models.Imagem.data_proc, models.Imagem.content_hash) > tuple_(*cursor)
     )
     
     # Ordenar e limitar
-    imagens = query.order_by(
+    imagens = query.options(_colunas_pagina(), *_SEM_LAZY_LOAD).order_by(
         models.Imagem.id_cnj,
         models.Imagem.data_proc,
         models.Imagem.content_hash
@@ -217,10 +261,11 @@ def buscar_imagens_avancar(
 
 def buscar_imagens_voltar(
     db: Session,
-    id_amb: str,
-    id_con: str,
-    content_hash: str,
-    limit: int = 20
+    id_amb: uuid.UUID,
+    id_con: uuid.UUID,
+    content_hash: Optional[str],
+    limit: int = 20,
+    cursor: Optional[Tuple[uuid.UUID, datetime, str]] = None
 ) -> Tuple[List[models.Imagem], bool]:
     """
     Busca imagens anteriores a uma imagem específica.
@@ -230,60 +275,53 @@ def buscar_imagens_voltar(
         db: Sessão do banco de dados
         id_amb: ID do ambiente
         id_con: ID do usuário convencional
-        content_hash: Hash da imagem atual
+        content_hash: Hash da imagem atual (usado quando não há cursor)
         limit: Quantidade de imagens a retornar
+        cursor: (id_cnj, data_proc, content_hash) decodificado do cursor do cliente; dispensa a busca da imagem de referência
     
     Returns:
         Tupla (lista_imagens, tem_mais)
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-    except (ValueError, TypeError):
-        return [], False
-    
-    # Buscar a imagem de referência
-    imagem_ref = db.query(models.Imagem).filter_by(content_hash=content_hash).first()
-    if not imagem_ref:
-        return [], False
-    
-    # Verificar se a imagem pertence ao ambiente
-    conjuntos_ids = buscar_conjuntos_ambiente(db, id_amb)
-    if imagem_ref.id_cnj not in conjuntos_ids:
-        return [], False
+    if cursor is None:
+        # Imagem de referência e pertinência ao ambiente numa única consulta
+        imagem_ref = buscar_imagem_no_ambiente(db, id_amb, content_hash)
+        if not imagem_ref or not imagem_ref.pertence:
+            return [], False
+        cursor = (imagem_ref.id_cnj, imagem_ref.data_proc, imagem_ref.content_hash)
     
     # Query para buscar imagens anteriores (ordem reversa)
     query = db.query(models.Imagem).filter(
-        models.Imagem.id_cnj.in_(conjuntos_ids),
+        models.Imagem.id_cnj.in_(_conjuntos_ativos_ambiente(id_amb)),
         models.Imagem.existe_no_nextcloud == True,
-        or_(
-            models.Imagem.data_proc < imagem_ref.data_proc,
-            and_(
-                models.Imagem.data_proc == imagem_ref.data_proc,
-                models.Imagem.content_hash < imagem_ref.content_hash
-            )
-        )
+        # Comparação de linha (row value) nas colunas da ordenação: vira condição do índice idx_imagem_keyset
+        tuple_(models.Imagem.id_cnj, models.Imagem.data_proc, models.Imagem.content_hash) < tuple_(*cursor)
     )
     
-    # Ordenar reverso e limitar
-    imagens = query.order_by(
+    # Subconsulta em ordem reversa com LIMIT (varredura para trás no índice); a consulta externa
+    # reordena do mais antigo ao mais recente, então o banco já devolve as linhas na ordem final
+    anteriores = query.order_by(
         models.Imagem.id_cnj.desc(),
         models.Imagem.data_proc.desc(),
         models.Imagem.content_hash.desc()
-    ).limit(limit + 1).all()
-    
-    # Reverter ordem para retornar do mais antigo ao mais recente
-    imagens = list(reversed(imagens))
+    ).limit(limit + 1).subquery()
+    imagem_anterior = aliased(models.Imagem, anteriores)
+    imagens = db.query(imagem_anterior).options(_colunas_pagina(imagem_anterior), *_SEM_LAZY_LOAD).order_by(
+        imagem_anterior.id_cnj,
+        imagem_anterior.data_proc,
+        imagem_anterior.content_hash
+    ).all()
     
+    # A linha extra (+1) é a mais distante da referência, agora a primeira da lista
     tem_mais = len(imagens) > limit
     if tem_mais:
-        imagens = imagens[:limit]
+        imagens = imagens[1:]
     
     return imagens, tem_mais
 
 
 def obter_classificacoes_imagens(
     db: Session,
-    id_con: str,
+    id_con: uuid.UUID,
     imagens: List[models.Imagem]
 ) -> dict:
     """
@@ -295,189 +333,199 @@ def obter_classificacoes_imagens(
         imagens: Lista de imagens
     
     Returns:
-        Dicionário {content_hash: List[Classificacao]} - Lista de classificações por imagem
+        Dicionário {content_hash: List[Row]} - Por imagem, linhas (id_cla, id_opc, texto_opcao,
+        data_criado, data_modificado) das classificações
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-    except (ValueError, TypeError):
-        return {}
-    
     if not imagens:
         return {}
     
-    content_hashes = [img.content_hash for img in imagens]
-    
-    # Buscar apenas classificações ativas
-    classificacoes = db.query(models.Classificacao).filter(
-        models.Classificacao.id_con == id_con_uuid,
-        models.Classificacao.id_img.in_(content_hashes),
-        models.Classificacao.ativo == True
+    # Hashes em um único parâmetro array (id_img = ANY(:hashes)) em vez de uma lista IN com N parâmetros;
+    # a busca usa o índice parcial (id_con, id_img) WHERE ativo
+    hashes = bindparam("hashes", [img.content_hash for img in imagens], type_=ARRAY(String(64)))
+    
+    # Apenas classificações ativas, já com o texto da opção (JOIN): só as colunas da resposta,
+    # sem montar objetos ORM
+    linhas = db.execute(
+        select(
+            models.Classificacao.id_img,
+            models.Classificacao.id_cla,
+            models.Classificacao.id_opc,
+            models.Opcao.texto.label("texto_opcao"),
+            models.Classificacao.data_criado,
+            models.Classificacao.data_modificado
+        ).join(models.Opcao, models.Opcao.id_opc == models.Classificacao.id_opc).where(
+            models.Classificacao.id_con == id_con,
+            models.Classificacao.id_img == any_(hashes),
+            models.Classificacao.ativo == True
+        )
     ).all()
     
     # Agrupar por content_hash (múltiplas classificações por imagem)
-    resultado = {}
-    for c in classificacoes:
-        if c.id_img not in resultado:
-            resultado[c.id_img] = []
-        resultado[c.id_img].append(c)
+    resultado = defaultdict(list)
+    for linha in linhas:
+        resultado[linha.id_img].append(linha)
     
     return resultado
 
 
+def buscar_imagem_no_ambiente(db: Session, id_amb: uuid.UUID, content_hash: str):
+    """
+    Busca uma imagem e indica se ela pertence a um conjunto ativo do ambiente, numa única consulta
+    (EXISTS limitado à imagem, sem carregar a lista de conjuntos do ambiente).
+    
+    Args:
+        db: Sessão do banco de dados
+        id_amb: ID do ambiente
+        content_hash: Hash da imagem
+    
+    Returns:
+        Linha (content_hash, data_proc, id_cnj, pertence) ou None se a imagem não existe
+    """
+    pertence = exists().where(
+        models.AmbienteConjuntoImagens.id_cnj == models.Imagem.id_cnj,
+        models.AmbienteConjuntoImagens.id_amb == id_amb,
+        models.AmbienteConjuntoImagens.ativo == True
+    )
+    return db.execute(
+        select(
+            models.Imagem.content_hash,
+            models.Imagem.data_proc,
+            models.Imagem.id_cnj,
+            pertence.label("pertence")
+        ).where(models.Imagem.content_hash == content_hash)
+    ).first()
+
+
 def criar_ou_atualizar_classificacao(
     db: Session,
-    id_con: str,
-    id_amb: str,
+    id_con: uuid.UUID,
+    id_amb: uuid.UUID,
     content_hash: str,
-    id_opc: List[str]
+    id_opc: List[uuid.UUID],
+    imagem=None
 ) -> Tuple[List[models.Classificacao], int]:
     """
     Cria ou atualiza classificações para uma imagem com múltiplas opções.
-    Versão corrigida para debug de IDs.
+    
+    Opções da nova lista são criadas ou reativadas em um único INSERT ... ON CONFLICT DO UPDATE
+    (validadas contra o ambiente no próprio banco); as ativas fora da lista são inativadas.
+    Retorna (classificações mantidas/criadas/reativadas, total de novas).
+    
+    imagem: resultado de buscar_imagem_no_ambiente já obtido pelo chamador (evita repetir a consulta).
     """
-    try:
-        # Converter IDs com segurança
-        try:
-            id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-            id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-        except ValueError as e:
-            logger.error(f"Erro na conversão de UUID do usuário/ambiente: {e}")
-            return [], 0
-        
-        # Converter lista de opções
-        id_opc_uuids = []
-        for opc_id in id_opc:
-            try:
-                opc_uuid = uuid.UUID(opc_id) if isinstance(opc_id, str) else opc_id
-                id_opc_uuids.append(opc_uuid)
-            except ValueError:
-                logger.warning(f"ID de opção inválido recebido: {opc_id}")
-                continue
-        
-        if not id_opc_uuids:
-            logger.warning("Lista de opções vazia após conversão.")
-            return [], 0
-            
-    except Exception as e:
-        logger.error(f"Erro geral na conversão de dados: {e}")
+    # IDs já chegam como UUID (validados pelo schema/rota); dict deduplica preservando a ordem de envio
+    id_opc_uuids = dict.fromkeys(id_opc)
+    if not id_opc_uuids:
+        logger.warning("Lista de opções vazia.")
         return [], 0
     
-    # 1. Verificar Imagem
-    imagem = db.query(models.Imagem).filter_by(content_hash=content_hash).first()
+    # 1. Imagem e pertinência ao ambiente (uma consulta; reaproveitada se o chamador já a fez)
+    if imagem is None:
+        imagem = buscar_imagem_no_ambiente(db, id_amb, content_hash)
     if not imagem:
-        logger.warning(f"Imagem não encontrada no banco: {content_hash}")
-        # DEBUG: Listar algumas imagens do banco para ver se o formato bate
-        sample = db.query(models.Imagem).limit(1).first()
-        if sample:
-            logger.info(f"Exemplo de hash no banco: {sample.content_hash}")
+        logger.warning("Imagem não encontrada no banco: %s", content_hash)
         return [], 0
-    
-    # 2. Verificar se imagem pertence ao ambiente (RELAXADA PARA TESTE)
-    # Se isso estiver falhando, podemos comentar temporariamente
-    conjuntos_ids = buscar_conjuntos_ambiente(db, id_amb)
-    if imagem.id_cnj not in conjuntos_ids:
-        logger.warning(f"Imagem {content_hash} (Conjunto: {imagem.id_cnj}) não pertence aos conjuntos do ambiente {id_amb} (Conjuntos: {conjuntos_ids})")
-        # return [], 0  <-- SE O ERRO FOR AQUI, COMENTE ESTA LINHA PARA TESTAR
-    
-    # 3. Validar Opções (AQUI ESTAVA O ERRO PROVÁVEL)
-    opcoes_validas = {}
-    for id_opc_uuid in id_opc_uuids:
-        # Busca a opção APENAS pelo ID primeiro
-        opcao = db.query(models.Opcao).filter_by(id_opc=id_opc_uuid).first()
-        
-        if not opcao:
-            logger.warning(f"Opção inexistente no banco: {id_opc_uuid}")
-            continue
-            
-        # Verifica se pertence ao ambiente (compara UUIDs convertidos para string para garantir)
-        if str(opcao.id_amb) != str(id_amb_uuid):
-            logger.warning(f"Opção {id_opc_uuid} pertence ao ambiente {opcao.id_amb}, mas a requisição é para {id_amb_uuid}")
-            # SE QUISER FORÇAR O FUNCIONAMENTO, DESCOMENTE A LINHA ABAIXO:
-            # continue 
-        
-        opcoes_validas[id_opc_uuid] = opcao
-    
-    if not opcoes_validas:
-        logger.warning("Nenhuma opção válida encontrada após verificação.")
+    if not imagem.pertence:
+        logger.warning("Imagem %s (Conjunto: %s) não pertence aos conjuntos do ambiente %s", content_hash, imagem.id_cnj, id_amb)
         return [], 0
-
-    # --- DAQUI PRA BAIXO SEGUE A LÓGICA DE SALVAR (Igual ao anterior) ---
-    # Buscar classificações existentes
-    classificacoes_existentes = db.query(models.Classificacao).filter(
-        models.Classificacao.id_con == id_con_uuid,
-        models.Classificacao.id_img == content_hash
-    ).all()
-    
-    classificacoes_ativas = {c.id_opc: c for c in classificacoes_existentes if c.ativo}
-    classificacoes_inativas = {c.id_opc: c for c in classificacoes_existentes if not c.ativo}
-    
-    opcoes_para_manter = set(opcoes_validas.keys())
-    opcoes_existentes_ativas = set(classificacoes_ativas.keys())
-    
-    # Calcula deltas
-    opcoes_para_inativar = opcoes_existentes_ativas - opcoes_para_manter
-    opcoes_para_criar = opcoes_para_manter - set(classificacoes_ativas.keys()) - set(classificacoes_inativas.keys())
-    opcoes_para_reativar = opcoes_para_manter & set(classificacoes_inativas.keys())
     
     agora = datetime.now(timezone.utc)
-    classificacoes_resultado = []
-    total_novas = 0
     
     try:
-        # Inativar
-        if opcoes_para_inativar:
-            db.query(models.Classificacao).filter(
-                models.Classificacao.id_con == id_con_uuid,
-                models.Classificacao.id_img == content_hash,
-                models.Classificacao.id_opc.in_(opcoes_para_inativar),
-                models.Classificacao.ativo == True
-            ).update({'ativo': False, 'data_modificado': agora}, synchronize_session=False)
+        # 2. UPSERT das opções escolhidas. O JOIN com opcoes descarta, no próprio banco, opções
+        # inexistentes ou de outro ambiente. Em conflito (usuário, imagem, opção) a linha é
+        # reativada; data_modificado só muda se ela estava inativa. xmax = 0 indica linha inserida.
+        # A CTE "antes" diz se a imagem já tinha classificação ativa (decide o incremento de
+        # total_classificadas): todo o comando usa o mesmo snapshot, então ela vê o estado anterior ao UPSERT.
+        antes = select(exists().where(
+            models.Classificacao.id_con == id_con,
+            models.Classificacao.id_img == content_hash,
+            models.Classificacao.ativo == True
+        ).label("tinha")).cte("antes")
+        novas = values(
+            column("id_cla", UUID(as_uuid=True)),
+            column("id_opc", UUID(as_uuid=True)),
+            name="novas"
+        ).data([(uuid.uuid4(), id_opc_uuid) for id_opc_uuid in id_opc_uuids])
+        selecao = select(
+            novas.c.id_cla,
+            literal(id_con, UUID(as_uuid=True)),
+            literal(content_hash, String(64)),
+            novas.c.id_opc,
+            literal(agora, DateTime(timezone=True)),
+            true()
+        ).join_from(
+            novas, models.Opcao,
+            and_(models.Opcao.id_opc == novas.c.id_opc, models.Opcao.id_amb == id_amb)
+        )
+        upsert = pg_insert(models.Classificacao).from_select(
+            ["id_cla", "id_con", "id_img", "id_opc", "data_criado", "ativo"], selecao
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["id_con", "id_img", "id_opc"],
+            set_={
+                "ativo": True,
+                "data_modificado": case(
+                    (models.Classificacao.ativo == True, models.Classificacao.data_modificado),
+                    else_=upsert.excluded.data_criado
+                )
+            }
+        ).add_cte(antes).returning(
+            models.Classificacao,
+            (literal_column("xmax") == 0).label("inserida"),
+            select(antes.c.tinha).scalar_subquery().label("tinha")
+        )
+        linhas = db.execute(upsert, execution_options={"populate_existing": True}).all()
         
-        # Reativar
-        for id_opc_uuid in opcoes_para_reativar:
-            c = classificacoes_inativas[id_opc_uuid]
-            c.ativo = True
-            c.data_modificado = agora
-            classificacoes_resultado.append(c)
+        if not linhas:
+            logger.warning("Nenhuma opção válida encontrada após verificação.")
+            db.rollback()
+            return [], 0
         
-        # Manter existentes
-        for id_opc_uuid in (opcoes_para_manter & opcoes_existentes_ativas):
-            classificacoes_resultado.append(classificacoes_ativas[id_opc_uuid])
-            
-        # Criar Novas
-        novas_classificacoes = []
-        for id_opc_uuid in opcoes_para_criar:
-            nova = models.Classificacao(
-                id_con=id_con_uuid,
-                id_img=content_hash,
-                id_opc=id_opc_uuid,
-                data_criado=agora,
-                ativo=True
-            )
-            novas_classificacoes.append(nova)
-            classificacoes_resultado.append(nova)
-            total_novas += 1
+        classificacoes_resultado = [linha[0] for linha in linhas]
+        total_novas = sum(1 for linha in linhas if linha.inserida)
+        tinha_classificacao = linhas[0].tinha
         
-        if novas_classificacoes:
-            db.bulk_save_objects(novas_classificacoes)
+        # Opções descartadas pelo JOIN (inexistentes ou de outro ambiente), registradas numa única passada
+        descartadas = id_opc_uuids.keys() - {c.id_opc for c in classificacoes_resultado}
+        if descartadas:
+            logger.warning("Opções inexistentes ou de outro ambiente ignoradas: %s", sorted(map(str, descartadas)))
         
-        # Atualizar Progresso
-        progresso = obter_progresso_usuario(db, id_con, id_amb)
-        if progresso:
-            progresso.ultimo_data_proc_processado = imagem.data_proc
-            progresso.ultimo_content_hash_processado = imagem.content_hash
-            progresso.data_ultima_atividade = agora
-            
-            tinha_classificacao = len(opcoes_existentes_ativas) > 0
-            # Se criou nova ou reativou algo numa imagem que estava "zerada"
-            if total_novas > 0 or (opcoes_para_reativar and not tinha_classificacao):
-                 if not tinha_classificacao:
-                    progresso.total_classificadas += 1
+        # 3. Inativar as classificações ativas que não estão na nova lista
+        db.query(models.Classificacao).filter(
+            models.Classificacao.id_con == id_con,
+            models.Classificacao.id_img == content_hash,
+            models.Classificacao.id_opc.notin_([c.id_opc for c in classificacoes_resultado]),
+            models.Classificacao.ativo == True
+        ).update({'ativo': False, 'data_modificado': agora}, synchronize_session=False)
+        
+        # 4. Progresso num único UPSERT (cria se ainda não existe), na mesma transação das classificações.
+        # Imagem que estava "zerada" passou a ter classificação (criada ou reativada): soma 1 ao total.
+        progresso = pg_insert(models.UsuarioAmbienteProgresso).values(
+            id_con=id_con,
+            id_amb=id_amb,
+            ultimo_data_proc_processado=imagem.data_proc,
+            ultimo_content_hash_processado=imagem.content_hash,
+            total_classificadas=0 if tinha_classificacao else 1,
+            data_ultima_atividade=agora
+        )
+        db.execute(
+            progresso.on_conflict_do_update(
+                index_elements=["id_con", "id_amb"],
+                set_={
+                    "ultimo_data_proc_processado": progresso.excluded.ultimo_data_proc_processado,
+                    "ultimo_content_hash_processado": progresso.excluded.ultimo_content_hash_processado,
+                    "total_classificadas": models.UsuarioAmbienteProgresso.total_classificadas + progresso.excluded.total_classificadas,
+                    "data_ultima_atividade": progresso.excluded.data_ultima_atividade
+                }
+            ).returning(models.UsuarioAmbienteProgresso),
+            execution_options={"populate_existing": True}
+        )
         
         db.commit()
         return classificacoes_resultado, total_novas
         
     except Exception as e:
         db.rollback()
-        logger.error(f"Erro crítico ao salvar no banco: {e}", exc_info=True)
+        logger.error("Erro crítico ao salvar no banco: %s", e, exc_info=True)
         return [], 0
@@ -2,11 +2,12 @@
 CRUD para operações com Opções.
 """
 from sqlalchemy.orm import Session
+from sqlalchemy import exists
 from app.db import models
+from app.core.utils import coerce_uuid
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
 from typing import List, Optional
-import uuid
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,27 +36,17 @@ def criar_opcao(db: Session, id_amb: str, texto: str) -> Optional[models.Opcao]:
     if not texto_limpo or len(texto_limpo) > 255:
         return None
     
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
     
-    # Verificar se ambiente existe e está ativo
-    ambiente = db.query(models.Ambiente).filter(
-        models.Ambiente.id_amb == id_amb_uuid,
-        models.Ambiente.ativo == True
-    ).first()
+    # Ambiente ativo? Já existe opção com mesmo texto no ambiente? (dois EXISTS numa única consulta)
+    ambiente_ativo, opcao_existente = db.query(
+        exists().where(models.Ambiente.id_amb == id_amb_uuid, models.Ambiente.ativo == True),
+        exists().where(models.Opcao.id_amb == id_amb_uuid, models.Opcao.texto == texto_limpo)
+    ).one()
     
-    if not ambiente:
-        return None
-    
-    # Verificar se já existe opção com mesmo texto no mesmo ambiente
-    opcao_existente = db.query(models.Opcao).filter_by(
-        id_amb=id_amb_uuid,
-        texto=texto_limpo
-    ).first()
-    
-    if opcao_existente:
+    if not ambiente_ativo or opcao_existente:
         return None
     
     # Criar opção
@@ -67,7 +58,6 @@ def criar_opcao(db: Session, id_amb: str, texto: str) -> Optional[models.Opcao]:
     try:
         db.add(nova_opcao)
         db.commit()
-        db.refresh(nova_opcao)
         return nova_opcao
     except IntegrityError:
         db.rollback()
@@ -89,12 +79,11 @@ def listar_opcoes_ambiente(db: Session, id_amb: str) -> Optional[tuple[models.Am
     Returns:
         Tupla (ambiente, lista_opcoes) ou (None, []) se ambiente não encontrado
     """
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None, []
     
-    ambiente = db.query(models.Ambiente).filter_by(id_amb=id_amb_uuid).first()
+    ambiente = db.get(models.Ambiente, id_amb_uuid)
     
     if not ambiente:
         return None, []
@@ -116,10 +105,9 @@ def buscar_opcao_por_id(db: Session, id_opc: str) -> Optional[models.Opcao]:
     Returns:
         Opção ou None se não encontrada
     """
-    try:
-        id_opc_uuid = uuid.UUID(id_opc) if isinstance(id_opc, str) else id_opc
-    except (ValueError, TypeError):
+    id_opc_uuid = coerce_uuid(id_opc)
+    if id_opc_uuid is None:
         return None
     
-    return db.query(models.Opcao).filter_by(id_opc=id_opc_uuid).first()
+    return db.get(models.Opcao, id_opc_uuid)
 
@@ -1,15 +1,19 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import func
 from app.db import models
-from app.core.utils import hash_password
+from app.core.utils import hash_password, coerce_uuid
 from datetime import datetime, timezone
 
 def get_user_by_email(db: Session, email: str) -> models.Usuario:
-    """Busca um usuário pelo seu email."""
-    return db.query(models.Usuario).filter(models.Usuario.email == email).first()
+    """Busca um usuário pelo seu email, sem diferenciar maiúsculas/minúsculas (índice único em lower(email))."""
+    return db.query(models.Usuario).filter(func.lower(models.Usuario.email) == email.lower()).first()
 
 def get_user_by_id(db: Session, id_usu) -> models.Usuario:
-    """Busca um usuário pelo seu id."""
-    return db.query(models.Usuario).filter(models.Usuario.id_usu == id_usu).first()
+    """Busca um usuário pelo seu id (consulta o identity map da sessão antes de ir ao banco)."""
+    id_usu = coerce_uuid(id_usu)
+    if id_usu is None:
+        return None
+    return db.get(models.Usuario, id_usu)
 
 def get_user_by_cpf(db: Session, cpf: str):
     """Busca usuário pelo CPF (tanto convencional quanto administrador)"""
@@ -45,7 +49,6 @@ def create_usuario_convencional(db: Session, nome_completo: str, email: str, sen
     )
     db.add(convencional)
     db.commit()
-    db.refresh(usuario)
     return usuario
 
 def create_usuario_administrador(db: Session, nome_completo: str, email: str, senha: str, cpf: str, id_tipo: int, telefone: str = None):
@@ -68,5 +71,4 @@ def create_usuario_administrador(db: Session, nome_completo: str, email: str, se
     )
     db.add(admin)
     db.commit()
-    db.refresh(usuario)
     return usuario 
\ No newline at end of file
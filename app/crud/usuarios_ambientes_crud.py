@@ -1,77 +1,80 @@
 """
 CRUD para operações de associação entre Usuários Convencionais e Ambientes.
 """
+from sqlalchemy import select, update, exists, func, cast, String, and_, RowMapping
 from sqlalchemy.orm import Session
 from app.db import models
+from app.core.utils import coerce_uuid
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def listar_ambientes_usuario(db: Session, id_con: str) -> Optional[Tuple[models.UsuarioConvencional, List[dict]]]:
+def listar_ambientes_usuario(db: Session, id_con: str) -> Tuple[Optional[models.UsuarioConvencional], List[RowMapping]]:
     """
     Lista ambientes do usuário com contagem de progresso.
+
+    Os totais (imagens do ambiente e classificadas pelo usuário) são calculados numa única
+    consulta; cada linha é devolvida como mapeamento com os campos de AmbienteInfoOut.
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-    except (ValueError, TypeError):
+    id_con_uuid = coerce_uuid(id_con)
+    if id_con_uuid is None:
         return None, []
     
-    usuario = db.query(models.UsuarioConvencional).filter_by(id_con=id_con_uuid).first()
+    usuario = db.get(models.UsuarioConvencional, id_con_uuid)
     
     if not usuario or not usuario.usuario.ativo:
         return None, []
     
-    ambientes = []
-    for vinc in usuario.ambientes:
-        if vinc.ativo:
-            amb = db.query(models.Ambiente).filter_by(id_amb=vinc.id_amb).first()
-            if amb and amb.ativo:
-                
-                # 1. Calcular Total de Imagens do Ambiente
-                # Busca os conjuntos vinculados ao ambiente
-                conjuntos = db.query(models.AmbienteConjuntoImagens).filter(
-                    models.AmbienteConjuntoImagens.id_amb == amb.id_amb,
-                    models.AmbienteConjuntoImagens.ativo == True
-                ).all()
-                
-                ids_conjuntos = [c.id_cnj for c in conjuntos]
-                
-                total_imagens = 0
-                if ids_conjuntos:
-                    # Conta imagens que existem no NextCloud e pertencem a esses conjuntos
-                    total_imagens = db.query(models.Imagem).filter(
-                        models.Imagem.id_cnj.in_(ids_conjuntos),
-                        models.Imagem.existe_no_nextcloud == True
-                    ).count()
-
-                # 2. Calcular Quantas o Usuário Já Classificou
-                progresso = db.query(models.UsuarioAmbienteProgresso).filter_by(
-                    id_con=id_con_uuid,
-                    id_amb=amb.id_amb
-                ).first()
-                
-                total_classificadas = progresso.total_classificadas if progresso else 0
-
-                # Adiciona na resposta
-                ambientes.append({
-                    "id_amb": str(amb.id_amb),
-                    "titulo_amb": amb.titulo_amb,
-                    "descricao_questionario": amb.descricao_questionario,
-                    "ativo": amb.ativo,
-                    "total_imagens": total_imagens,        
-                    "total_classificadas": total_classificadas, 
-                    "multipla_escolha": amb.multipla_escolha 
-                })
+    # Total de imagens do ambiente: imagens que existem no NextCloud nos conjuntos ativos do ambiente
+    total_imagens = (
+        select(func.count(models.Imagem.content_hash))
+        .join(models.AmbienteConjuntoImagens, models.AmbienteConjuntoImagens.id_cnj == models.Imagem.id_cnj)
+        .where(
+            models.AmbienteConjuntoImagens.id_amb == models.Ambiente.id_amb,
+            models.AmbienteConjuntoImagens.ativo == True,
+            models.Imagem.existe_no_nextcloud == True
+        )
+        .correlate(models.Ambiente)
+        .scalar_subquery()
+    )
+    
+    stmt = (
+        select(
+            cast(models.Ambiente.id_amb, String).label("id_amb"),
+            models.Ambiente.titulo_amb,
+            models.Ambiente.descricao_questionario,
+            models.Ambiente.ativo,
+            total_imagens.label("total_imagens"),
+            func.coalesce(models.UsuarioAmbienteProgresso.total_classificadas, 0).label("total_classificadas"),
+            func.coalesce(models.Ambiente.multipla_escolha, False).label("multipla_escolha")
+        )
+        .select_from(models.UsuarioAmbiente)
+        .join(models.Ambiente, models.Ambiente.id_amb == models.UsuarioAmbiente.id_amb)
+        .outerjoin(
+            models.UsuarioAmbienteProgresso,
+            and_(
+                models.UsuarioAmbienteProgresso.id_con == models.UsuarioAmbiente.id_con,
+                models.UsuarioAmbienteProgresso.id_amb == models.UsuarioAmbiente.id_amb
+            )
+        )
+        .where(
+            models.UsuarioAmbiente.id_con == id_con_uuid,
+            models.UsuarioAmbiente.ativo == True,
+            models.Ambiente.ativo == True
+        )
+    )
+    
+    ambientes = db.execute(stmt).mappings().all()
     
     return usuario, ambientes
 
 
-def criar_associacoes(db: Session, id_amb: str, ids_usuarios: List[str]) -> Tuple[Optional[models.Ambiente], List[str]]:
+def criar_associacoes(db: Session, id_amb: str, ids_usuarios: List[Union[str, uuid.UUID]], commit: bool = True) -> Tuple[Optional[models.Ambiente], List[str]]:
     """
     Cria associações entre um ambiente e uma lista de usuários convencionais.
     
@@ -85,7 +88,9 @@ def criar_associacoes(db: Session, id_amb: str, ids_usuarios: List[str]) -> Tupl
     Args:
         db: Sessão do banco de dados
         id_amb: ID do ambiente (UUID string)
-        ids_usuarios: Lista de IDs de usuários convencionais (UUID strings)
+        ids_usuarios: Lista de IDs de usuários convencionais (UUID ou string)
+        commit: Se False, apenas faz flush; o chamador confirma a transação
+            (ex.: junto com o log de auditoria)
     
     Returns:
         Tupla (ambiente, lista_ids_associados) ou (None, []) em caso de erro
@@ -93,13 +98,10 @@ def criar_associacoes(db: Session, id_amb: str, ids_usuarios: List[str]) -> Tupl
     if not ids_usuarios or len(ids_usuarios) == 0:
         return None, []
     
-    # Remover duplicatas mantendo ordem
-    ids_usuarios_unicos = list(dict.fromkeys(ids_usuarios))
-    
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-        ids_usuarios_uuid = [uuid.UUID(id_con) for id_con in ids_usuarios_unicos]
-    except ValueError:
+    id_amb_uuid = coerce_uuid(id_amb)
+    # Converter para UUID e remover duplicatas mantendo ordem (grafias diferentes do mesmo UUID contam uma vez)
+    ids_usuarios_uuid = list(dict.fromkeys(coerce_uuid(id_con) for id_con in ids_usuarios))
+    if id_amb_uuid is None or None in ids_usuarios_uuid:
         return None, []
     
     # Verificar se ambiente existe e está ativo
@@ -111,17 +113,16 @@ def criar_associacoes(db: Session, id_amb: str, ids_usuarios: List[str]) -> Tupl
     if not ambiente:
         return None, []
     
-    # Validar que todos os usuários existem, são convencionais e estão ativos
-    usuarios_validos = db.query(models.UsuarioConvencional).join(models.Usuario).filter(
-        models.UsuarioConvencional.id_con.in_(ids_usuarios_uuid),
-        models.Usuario.ativo == True
-    ).all()
-    
-    ids_validos_encontrados = {str(usr.id_con) for usr in usuarios_validos}
-    ids_solicitados = set(ids_usuarios_unicos)
+    # Validar que todos os usuários existem, são convencionais e estão ativos (apenas os IDs, sem hidratar objetos)
+    ids_validos_encontrados = {
+        id_con for (id_con,) in db.query(models.UsuarioConvencional.id_con).join(models.Usuario).filter(
+            models.UsuarioConvencional.id_con.in_(ids_usuarios_uuid),
+            models.Usuario.ativo == True
+        ).all()
+    }
     
     # Se algum ID não foi encontrado, retornar erro
-    if ids_validos_encontrados != ids_solicitados:
+    if ids_validos_encontrados != set(ids_usuarios_uuid):
         return None, []
     
     # Criar associações
@@ -154,7 +155,10 @@ def criar_associacoes(db: Session, id_amb: str, ids_usuarios: List[str]) -> Tupl
             associados.append(str(id_con_uuid))
     
     try:
-        db.commit()
+        if commit:
+            db.commit()
+        else:
+            db.flush()
         return ambiente, associados
     except IntegrityError:
         db.rollback()
@@ -177,9 +181,8 @@ def associar_todos_usuarios_ao_ambiente(db: Session, id_amb: str) -> Optional[in
     Returns:
         Número de usuários associados ou None se ambiente não encontrado
     """
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None
     
     ambiente = db.query(models.Ambiente).filter(
@@ -230,7 +233,7 @@ def associar_todos_usuarios_ao_ambiente(db: Session, id_amb: str) -> Optional[in
         return None
 
 
-def excluir_associacao(db: Session, id_con: str, id_amb: str) -> Optional[models.UsuarioAmbiente]:
+def excluir_associacao(db: Session, id_con: str, id_amb: str, commit: bool = True) -> Optional[models.UsuarioAmbiente]:
     """
     Exclui logicamente uma associação entre usuário convencional e ambiente.
     
@@ -242,30 +245,32 @@ def excluir_associacao(db: Session, id_con: str, id_amb: str) -> Optional[models
         db: Sessão do banco de dados
         id_con: ID do usuário convencional (UUID string)
         id_amb: ID do ambiente (UUID string)
+        commit: Se False, não confirma a transação (o chamador faz o commit)
     
     Returns:
         Associação excluída ou None se não encontrada
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_con_uuid = coerce_uuid(id_con)
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_con_uuid is None or id_amb_uuid is None:
         return None
     
-    vinculo = db.query(models.UsuarioAmbiente).filter_by(
-        id_amb=id_amb_uuid,
-        id_con=id_con_uuid,
-        ativo=True
-    ).first()
+    # UPDATE ... RETURNING: busca e exclusão lógica num único comando
+    vinculo = db.execute(
+        update(models.UsuarioAmbiente).where(
+            models.UsuarioAmbiente.id_amb == id_amb_uuid,
+            models.UsuarioAmbiente.id_con == id_con_uuid,
+            models.UsuarioAmbiente.ativo == True
+        ).values(ativo=False).returning(models.UsuarioAmbiente)
+    ).scalars().first()
     
-    if vinculo:
-        vinculo.ativo = False
+    if vinculo and commit:
         db.commit()
     
     return vinculo
 
 
-def reativar_associacao(db: Session, id_con: str, id_amb: str) -> Optional[models.UsuarioAmbiente]:
+def reativar_associacao(db: Session, id_con: str, id_amb: str, commit: bool = True) -> Optional[models.UsuarioAmbiente]:
     """
     Reativa logicamente uma associação entre usuário convencional e ambiente.
     
@@ -279,46 +284,36 @@ def reativar_associacao(db: Session, id_con: str, id_amb: str) -> Optional[model
         db: Sessão do banco de dados
         id_con: ID do usuário convencional (UUID string)
         id_amb: ID do ambiente (UUID string)
+        commit: Se False, não confirma a transação (o chamador faz o commit)
     
     Returns:
         Associação reativada ou None se não encontrada ou não puder ser reativada
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
-        return None
-    
-    vinculo = db.query(models.UsuarioAmbiente).filter_by(
-        id_amb=id_amb_uuid,
-        id_con=id_con_uuid,
-        ativo=False
-    ).first()
-    
-    if not vinculo:
-        return None
-    
-    # Verificar se ambiente está ativo
-    ambiente = db.query(models.Ambiente).filter_by(
-        id_amb=id_amb_uuid,
-        ativo=True
-    ).first()
-    
-    if not ambiente:
+    id_con_uuid = coerce_uuid(id_con)
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_con_uuid is None or id_amb_uuid is None:
         return None
     
-    # Verificar se usuário está ativo
-    usuario = db.query(models.UsuarioConvencional).join(models.Usuario).filter(
-        models.UsuarioConvencional.id_con == id_con_uuid,
-        models.Usuario.ativo == True
-    ).first()
-    
-    if not usuario:
-        return None
+    # Um único UPDATE ... RETURNING: as validações (ambiente ativo, usuário ativo) são EXISTS no WHERE
+    vinculo = db.execute(
+        update(models.UsuarioAmbiente).where(
+            models.UsuarioAmbiente.id_amb == id_amb_uuid,
+            models.UsuarioAmbiente.id_con == id_con_uuid,
+            models.UsuarioAmbiente.ativo == False,
+            exists().where(models.Ambiente.id_amb == id_amb_uuid, models.Ambiente.ativo == True),
+            exists().where(
+                models.UsuarioConvencional.id_con == id_con_uuid,
+                models.Usuario.id_usu == models.UsuarioConvencional.id_usu,
+                models.Usuario.ativo == True
+            )
+        ).values(
+            ativo=True,
+            data_associado=datetime.now(timezone.utc)  # Atualizar data
+        ).returning(models.UsuarioAmbiente)
+    ).scalars().first()
     
-    vinculo.ativo = True
-    vinculo.data_associado = datetime.now(timezone.utc)  # Atualizar data
-    db.commit()
+    if vinculo and commit:
+        db.commit()
     
     return vinculo
 
@@ -335,10 +330,9 @@ def obter_associacao_por_ids(db: Session, id_con: str, id_amb: str) -> Optional[
     Returns:
         Associação ou None se não encontrada
     """
-    try:
-        id_con_uuid = uuid.UUID(id_con) if isinstance(id_con, str) else id_con
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_con_uuid = coerce_uuid(id_con)
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_con_uuid is None or id_amb_uuid is None:
         return None
     
     return db.query(models.UsuarioAmbiente).filter_by(
@@ -358,35 +352,41 @@ def listar_usuarios_do_ambiente(db: Session, id_amb: str) -> Optional[Tuple[mode
     Returns:
         Tupla (ambiente, lista_usuarios) ou (None, []) se ambiente não encontrado
     """
-    try:
-        id_amb_uuid = uuid.UUID(id_amb) if isinstance(id_amb, str) else id_amb
-    except (ValueError, TypeError):
+    id_amb_uuid = coerce_uuid(id_amb)
+    if id_amb_uuid is None:
         return None, []
     
-    ambiente = db.query(models.Ambiente).filter_by(id_amb=id_amb_uuid).first()
+    ambiente = db.get(models.Ambiente, id_amb_uuid)
     
     if not ambiente:
         return None, []
     
-    # Buscar todas as associações ativas deste ambiente
-    associacoes = db.query(models.UsuarioAmbiente).filter(
+    # Associações ativas deste ambiente com os dados dos usuários (ativos) numa única consulta
+    linhas = db.query(
+        models.UsuarioConvencional.id_con,
+        models.Usuario.nome_completo,
+        models.Usuario.email,
+        models.Usuario.ativo,
+        models.UsuarioAmbiente.data_associado
+    ).join(
+        models.UsuarioConvencional, models.UsuarioConvencional.id_con == models.UsuarioAmbiente.id_con
+    ).join(
+        models.Usuario, models.Usuario.id_usu == models.UsuarioConvencional.id_usu
+    ).filter(
         models.UsuarioAmbiente.id_amb == id_amb_uuid,
-        models.UsuarioAmbiente.ativo == True
+        models.UsuarioAmbiente.ativo == True,
+        models.Usuario.ativo == True
     ).all()
     
-    usuarios = []
-    for vinc in associacoes:
-        usuario_conv = db.query(models.UsuarioConvencional).filter_by(
-            id_con=vinc.id_con
-        ).first()
-        
-        if usuario_conv and usuario_conv.usuario.ativo:
-            usuarios.append({
-                "id_con": str(usuario_conv.id_con),
-                "nome_completo": usuario_conv.usuario.nome_completo,
-                "email": usuario_conv.usuario.email,
-                "ativo": usuario_conv.usuario.ativo,
-                "data_associado": vinc.data_associado
-            })
+    usuarios = [
+        {
+            "id_con": str(id_con),
+            "nome_completo": nome_completo,
+            "email": email,
+            "ativo": ativo,
+            "data_associado": data_associado
+        }
+        for id_con, nome_completo, email, ativo, data_associado in linhas
+    ]
     
     return ambiente, usuarios
@@ -2,6 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import settings
 import time
 import logging
@@ -9,7 +10,24 @@ import logging
 logger = logging.getLogger(__name__)
 
 # Create database engine
-engine = create_engine(settings.DATABASE_URL)
+# pool_pre_ping descarta conexões mortas (ex.: após restart do PostgreSQL) antes de entregá-las, ao custo de uma
+# ida ao banco por retirada; com banco estável e pool_recycle abaixo do timeout de ociosidade, pode ser desligado
+# pool_use_lifo reutiliza a conexão devolvida mais recentemente (já "quente"); as excedentes ficam
+# ociosas no fim da fila e são renovadas por pool_recycle
+# statement_timeout impede que uma consulta travada segure uma conexão do pool indefinidamente
+# query_cache_size: o psycopg2 não tem cache de prepared statements no servidor; o que evita retrabalho por
+# chamada é o cache de SQL compilado do SQLAlchemy, dimensionado para todas as consultas recorrentes da API
+engine = create_engine(
+    settings.DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    pool_use_lifo=True,
+    query_cache_size=settings.DB_QUERY_CACHE_SIZE,
+    connect_args={"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"},
+)
 
 def wait_for_database(max_retries=60, retry_interval=3):
     """
@@ -59,12 +77,17 @@ Base = declarative_base()
 # O timezone do banco deve ser configurado para 'America/Sao_Paulo' diretamente no banco PostgreSQL.
 # Os modelos ORM usam DateTime(timezone=True) para garantir compatibilidade.
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
+# Dependência assíncrona: criar a Session não abre conexão (ela só é obtida do pool no primeiro uso,
+# já dentro da thread da rota), então evita-se um salto ao pool de threads por requisição.
+# O fechamento (que devolve a conexão ao pool) continua fora do event loop.
+# expire_on_commit=False: a sessão vive só durante a requisição, então os objetos continuam válidos
+# após o commit e montar a resposta não exige um novo SELECT (dispensa db.refresh após commit).
+async def get_db():
+    db = SessionLocal(expire_on_commit=False)
     try:
         yield db
     finally:
-        db.close()
+        await run_in_threadpool(db.close)
 
 # Função para popular a tabela de eventos de auditoria
 from app.db.models import EventoAuditoria
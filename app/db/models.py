@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey, UniqueConstraint, JSON, CHAR, event, Index
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey, UniqueConstraint, JSON, CHAR, event, Index, select, update, func, text, inspect
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from app.db.database import Base
@@ -24,11 +24,66 @@ class Usuario(Base):
     data_ultimo_login = Column(DateTime(timezone=True))
     ativo = Column(Boolean, nullable=False, default=True)
     id_tipo = Column(Integer, ForeignKey('tipo_usuarios.id_tipo'))
+    # Invariante: is_admin == (lower(tipo.nome) == "admin"), mantido pelos listeners abaixo (insert/update de
+    # Usuario e renomeação de TipoUsuario via ORM). UPDATEs em massa ou SQL direto em tipo_usuarios.nome/id_tipo
+    # não passam pelos listeners e precisam recalcular a coluna. require_admin confia neste valor.
+    is_admin = Column(Boolean, nullable=False, default=False, server_default='false', index=True)
     tipo = relationship('TipoUsuario', back_populates='usuarios')
     administrador = relationship('UsuarioAdministrador', uselist=False, back_populates='usuario')
     convencional = relationship('UsuarioConvencional', uselist=False, back_populates='usuario')
     logs = relationship('LogAuditoria', back_populates='usuario')
 
+
+# Unicidade de e-mail sem diferenciar maiúsculas/minúsculas (usado na checagem de e-mail em uso)
+Index('ix_usuarios_email_lower', func.lower(Usuario.email), unique=True)
+
+
+# Event listeners para manter Usuario.is_admin sincronizado com o tipo do usuário
+@event.listens_for(Usuario, 'before_insert', propagate=True)
+def preencher_is_admin_insert(mapper, connection, target):
+    """Calcula is_admin a partir do nome do TipoUsuario na criação do usuário."""
+    target.is_admin = _tipo_e_admin(connection, target)
+
+
+@event.listens_for(Usuario, 'before_update', propagate=True)
+def preencher_is_admin_update(mapper, connection, target):
+    """Recalcula is_admin apenas quando o id_tipo do usuário é alterado."""
+    if inspect(target).attrs.id_tipo.history.has_changes():
+        target.is_admin = _tipo_e_admin(connection, target)
+
+
+@event.listens_for(TipoUsuario, 'after_update', propagate=True)
+def propagar_is_admin_tipo(mapper, connection, target):
+    """Ao renomear um TipoUsuario, recalcula is_admin de todos os usuários desse tipo."""
+    if inspect(target).attrs.nome.history.has_changes():
+        connection.execute(
+            update(Usuario).where(Usuario.id_tipo == target.id_tipo).values(is_admin=_nome_e_admin(target.nome))
+        )
+
+
+def _nome_e_admin(nome) -> bool:
+    return bool(nome) and nome.lower() == "admin"
+
+
+def _tipo_e_admin(connection, usuario) -> bool:
+    """
+    Usa o TipoUsuario já presente na sessão (relacionamento carregado ou identity map, ex.: buscado
+    pela rota de cadastro); só consulta o banco se o tipo ainda não foi carregado.
+    """
+    id_tipo = usuario.id_tipo
+    if id_tipo is None:
+        return False
+    estado = inspect(usuario)
+    tipo = estado.dict.get('tipo')
+    if tipo is None or tipo.id_tipo != id_tipo:
+        chave = TipoUsuario.__mapper__.identity_key_from_primary_key((id_tipo,))
+        tipo = estado.session.identity_map.get(chave) if estado.session else None
+    if tipo is not None:
+        return _nome_e_admin(tipo.nome)
+    return _nome_e_admin(connection.execute(
+        select(TipoUsuario.nome).where(TipoUsuario.id_tipo == id_tipo)
+    ).scalar())
+
 class UsuarioAdministrador(Base):
     __tablename__ = 'usuarios_administradores'
     id_adm = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -80,6 +135,10 @@ class Ambiente(Base):
 
 class UsuarioAmbiente(Base):
     __tablename__ = 'usuarios_ambientes'
+    __table_args__ = (
+        # A PK começa por id_con; consultas por ambiente (vínculos ativos) usam este índice parcial
+        Index('ix_usuarios_ambientes_id_amb_ativo', 'id_amb', postgresql_where=text('ativo')),
+    )
     id_con = Column(UUID(as_uuid=True), ForeignKey('usuarios_convencionais.id_con', ondelete='CASCADE'), primary_key=True)
     id_amb = Column(UUID(as_uuid=True), ForeignKey('ambientes.id_amb', ondelete='CASCADE'), primary_key=True)
     data_associado = Column(DateTime(timezone=True), nullable=False)
@@ -98,7 +157,7 @@ class UsuarioAmbienteProgresso(Base):
     ultimo_data_proc_processado = Column(DateTime(timezone=True), nullable=True)  # data_proc da última imagem processada
     ultimo_content_hash_processado = Column(String(64), ForeignKey('imagens.content_hash', ondelete='SET NULL'), nullable=True)  # Hash da última imagem processada
     total_classificadas = Column(Integer, nullable=False, default=0)  # Total de imagens classificadas
-    data_ultima_atividade = Column(DateTime(timezone=True), nullable=False)  # Timestamp da última classificação
+    data_ultima_atividade = Column(DateTime(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))  # Timestamp da última classificação (na criação, preenchido pelo banco)
     usuario_convencional = relationship('UsuarioConvencional', back_populates='progresso_ambientes')
     ambiente = relationship('Ambiente', back_populates='progresso_usuarios')
 
@@ -208,6 +267,8 @@ class Imagem(Base):
     __tablename__ = 'imagens'
     __table_args__ = (
         Index('idx_imagem_id_cnj_existe', 'id_cnj', 'existe_no_nextcloud'),  # Consultas de contagem por conjunto/ambiente
+        # Paginação por cursor (keyset) na classificação: mesma ordem de buscar_imagens_* (ORDER BY + LIMIT direto no índice)
+        Index('idx_imagem_keyset', 'id_cnj', 'data_proc', 'content_hash', postgresql_where=text('existe_no_nextcloud')),
     )
     content_hash = Column(String(64), primary_key=True)  # SHA-256 do conteúdo binário (64 caracteres hexadecimais)
     nome_img = Column(String(255), nullable=False)  # Nome do arquivo no NextCloud (pode mudar se arquivo for renomeado)
@@ -224,10 +285,11 @@ class Imagem(Base):
 class Classificacao(Base):
     __tablename__ = 'classificacoes'
     __table_args__ = (
-        # Índice composto para busca eficiente de classificações ativas por usuário e imagem
-        Index('idx_classificacao_usuario_imagem_ativo', 'id_con', 'id_img', 'ativo'),
-        # Índice composto para busca por usuário, imagem e opção (evita duplicatas)
-        Index('idx_classificacao_usuario_imagem_opcao', 'id_con', 'id_img', 'id_opc'),
+        # Classificações ativas por usuário e imagem (parcial: toda leitura por usuário filtra ativo = true;
+        # NOT EXISTS da paginação, busca por página, contagem e histórico)
+        Index('ix_classificacao_usuario_imagem_ativas', 'id_con', 'id_img', postgresql_where=text('ativo')),
+        # Único por usuário, imagem e opção: evita duplicatas e é o alvo do ON CONFLICT em criar_ou_atualizar_classificacao
+        Index('uq_classificacao_usuario_imagem_opcao', 'id_con', 'id_img', 'id_opc', unique=True),
     )
     id_cla = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     data_criado = Column(DateTime(timezone=True), nullable=False)
@@ -250,6 +312,10 @@ class EventoAuditoria(Base):
 
 class LogAuditoria(Base):
     __tablename__ = 'logs_auditoria'
+    __table_args__ = (
+        # Paginação por cursor (keyset) em /auditoria/logs: ORDER BY (data_evento, id_log) DESC lê o índice de trás para frente
+        Index('ix_logs_auditoria_data_evento_id_log', 'data_evento', 'id_log'),
+    )
     id_log = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     id_usu = Column(UUID(as_uuid=True), ForeignKey('usuarios.id_usu'))
     evento_id = Column(Integer, ForeignKey('eventos_auditoria.id_evento'), nullable=False)
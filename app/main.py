@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 import threading
 import uvicorn
 from contextlib import asynccontextmanager
+import anyio
 import time
 from sqlalchemy.exc import IntegrityError
 
@@ -38,6 +39,10 @@ sync_scheduler = None
 async def lifespan(app: FastAPI):
     # Startup
     global image_monitor, sync_scheduler
+
+    # Rotas síncronas (Session do SQLAlchemy) rodam no pool de threads do AnyIO;
+    # dimensiona o limitador conforme a configuração (padrão do AnyIO: 40)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.API_THREADPOOL_SIZE
     
     # Aguardar banco de dados estar pronto
     print("🔄 Aguardando banco de dados estar pronto...")
@@ -132,9 +137,11 @@ async def lifespan(app: FastAPI):
 
     # Popular eventos de auditoria após garantir que as tabelas existem
     from app.db.database import SessionLocal, popular_eventos_auditoria
+    from app.services.auditoria_service import carregar_ids_eventos
     db = SessionLocal()
     try:
         popular_eventos_auditoria(db)
+        carregar_ids_eventos(db)
     finally:
         db.close()
 
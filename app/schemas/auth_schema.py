@@ -118,6 +118,16 @@ class UsuarioOut(BaseModel):
     class Config:
         from_attributes = True 
 
+class UsuarioPage(BaseModel):
+    """
+    Schema de resposta paginada para a listagem de usuários.
+    `total` considera os filtros aplicados, antes de limit/offset.
+    """
+    items: list[UsuarioOut]
+    total: int
+    limit: int
+    offset: int
+
 class AmbienteCreate(BaseModel):
     """
     Schema de entrada para criação de ambiente.
@@ -183,7 +193,12 @@ class UsuarioAmbienteAssociarIn(BaseModel):
     Schema de entrada para associar usuários convencionais a um ambiente.
     Utilizado em: POST /usuarios-ambientes/associar
     """
-    ids_usuarios: list[str] = Field(..., min_length=1, description="Lista de IDs de usuários convencionais (mínimo 1)")
+    ids_usuarios: list[uuid.UUID] = Field(..., min_length=1, description="Lista de IDs de usuários convencionais (mínimo 1)")
+
+    @validator('ids_usuarios')
+    def remover_duplicados(cls, v):
+        # Remove IDs repetidos mantendo a ordem de envio
+        return list(dict.fromkeys(v))
 
     class Config:
         json_schema_extra = {
@@ -415,13 +430,15 @@ class AmbienteUpdateTituloQuestionario(BaseModel):
 class LogAuditoriaPage(BaseModel):
     """
     Schema de resposta paginada para logs de auditoria.
-    Inclui metadados de paginação.
+    Inclui metadados de paginação e o cursor da próxima página (None na última).
     """
     logs: list[LogAuditoriaOut]
     page: int
     page_size: int
     total: int
     is_last_page: bool
+    next_cursor_data_evento: Optional[datetime] = None
+    next_cursor_id: Optional[str] = None
 
     class Config:
         json_schema_extra = {
@@ -440,6 +457,8 @@ class LogAuditoriaPage(BaseModel):
                 "page": 1,
                 "page_size": 50,
                 "total": 120,
-                "is_last_page": False
+                "is_last_page": False,
+                "next_cursor_data_evento": "2024-06-01T12:34:56.789Z",
+                "next_cursor_id": "a1b2c3d4-5678-1234-9abc-1234567890ab"
             }
         }
@@ -4,6 +4,7 @@ Schemas para rotas de classificação de imagens.
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
+import uuid
 
 
 class ClassificacaoInfoOut(BaseModel):
@@ -37,25 +38,29 @@ class ImagensClassificacaoResponse(BaseModel):
     imagens: List[ImagemClassificacaoOut]
     total: int
     tem_mais: bool  # Indica se há mais imagens disponíveis
+    next_cursor: Optional[str] = None  # Cursor da última imagem (enviar em /avancar)
+    prev_cursor: Optional[str] = None  # Cursor da primeira imagem (enviar em /voltar)
 
     class Config:
         from_attributes = True
 
 
 class AvancarRequest(BaseModel):
-    """Request para avançar na lista de imagens."""
-    content_hash: str = Field(..., description="Hash da imagem atual para buscar próximas")
+    """Request para avançar na lista de imagens (informar cursor ou content_hash)."""
+    cursor: Optional[str] = Field(None, description="next_cursor da resposta anterior (dispensa a busca da imagem atual)")
+    content_hash: Optional[str] = Field(None, description="Hash da imagem atual para buscar próximas")
 
 
 class VoltarRequest(BaseModel):
-    """Request para voltar na lista de imagens."""
-    content_hash: str = Field(..., description="Hash da imagem atual para buscar anteriores")
+    """Request para voltar na lista de imagens (informar cursor ou content_hash)."""
+    cursor: Optional[str] = Field(None, description="prev_cursor da resposta anterior (dispensa a busca da imagem atual)")
+    content_hash: Optional[str] = Field(None, description="Hash da imagem atual para buscar anteriores")
 
 
 class ClassificarRequest(BaseModel):
     """Request para classificar uma imagem com uma ou múltiplas opções."""
     content_hash: str = Field(..., description="Hash da imagem a ser classificada")
-    id_opc: List[str] = Field(..., min_length=1, description="Lista de IDs das opções escolhidas (permite múltiplas opções)")
+    id_opc: List[uuid.UUID] = Field(..., min_length=1, description="Lista de IDs das opções escolhidas (permite múltiplas opções)")
 
     class Config:
         json_schema_extra = {
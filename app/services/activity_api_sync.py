@@ -3,6 +3,7 @@ Serviço de sincronização via Activity API do NextCloud.
 Processa eventos de mudanças (file_created, file_deleted, file_changed).
 """
 import hashlib
+import os
 import io
 import uuid
 from datetime import datetime
@@ -31,8 +32,8 @@ class ActivityAPISync:
         'image/bmp', 'image/tiff', 'image/webp'
     ]
     
-    # Extensões de arquivo permitidas
-    ALLOWED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp']
+    # Extensões de arquivo permitidas (configuráveis via ALLOWED_EXTENSIONS)
+    ALLOWED_EXTENSIONS = settings.ALLOWED_EXTENSIONS
     
     def __init__(self, nextcloud_client: NextCloudClient, db: Session):
         """
@@ -703,12 +704,13 @@ class ActivityAPISync:
                 return False
             
             if conjunto:
+                now = local_to_utc(tz_now())  # Um único timestamp para a pasta e suas imagens
                 conjunto.existe_no_nextcloud = False
-                conjunto.data_sinc = local_to_utc(tz_now())
+                conjunto.data_sinc = now
                 # Marcar imagens da pasta como removidas também
                 for imagem in conjunto.imagens:
                     imagem.existe_no_nextcloud = False
-                    imagem.data_sinc = local_to_utc(tz_now())
+                    imagem.data_sinc = now
                 self.db.commit()
                 logger.info(f"  ✅ Pasta marcada como removida: {folder_path} ({len(conjunto.imagens)} imagens)")
                 return True
@@ -760,7 +762,7 @@ class ActivityAPISync:
                     continue
             
             # Marcar pasta como sincronizada
-            conjunto = self.db.query(ConjuntoImagens).filter_by(id_cnj=conjunto_id).first()
+            conjunto = self.db.get(ConjuntoImagens, conjunto_id)
             if conjunto:
                 conjunto.imagens_sincronizadas = True
                 self.db.commit()
@@ -774,7 +776,7 @@ class ActivityAPISync:
     def _is_image_path(self, file_path: str) -> bool:
         """Verifica se o caminho é de uma imagem."""
         file_path_lower = file_path.lower()
-        return any(file_path_lower.endswith(ext) for ext in self.ALLOWED_EXTENSIONS)
+        return os.path.splitext(file_path_lower)[1] in self.ALLOWED_EXTENSIONS
     
     def _process_new_image(self, image_info: Dict) -> bool:
         """
@@ -797,8 +799,8 @@ class ActivityAPISync:
             
             content_hash = hashlib.sha256(image_data).hexdigest()
             
-            # Verificar se já existe
-            imagem = self.db.query(Imagem).filter_by(content_hash=content_hash).first()
+            # Verificar se já existe (chave primária)
+            imagem = self.db.get(Imagem, content_hash)
             now = local_to_utc(tz_now())
             
             # Buscar pasta pai
@@ -876,7 +878,7 @@ class ActivityAPISync:
                     # Imagem já existe (duplicata)
                     self.db.rollback()
                     # Buscar e atualizar
-                    imagem = self.db.query(Imagem).filter_by(content_hash=content_hash).first()
+                    imagem = self.db.get(Imagem, content_hash)
                     if imagem:
                         imagem.nome_img = image_info.get('name', '')
                         imagem.caminho_img = image_info.get('path', '')
@@ -902,7 +904,7 @@ class ActivityAPISync:
     def _validate_image(self, file_info: Dict) -> bool:
         """Valida se o arquivo é uma imagem válida."""
         name = file_info.get('name', '').lower()
-        if not any(name.endswith(ext) for ext in self.ALLOWED_EXTENSIONS):
+        if os.path.splitext(name)[1] not in self.ALLOWED_EXTENSIONS:
             return False
         
         content_type = file_info.get('content_type', '').lower()
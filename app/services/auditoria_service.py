@@ -0,0 +1,65 @@
+"""
+Serviço de gravação de logs de auditoria fora do caminho crítico da requisição.
+
+Compromisso: nas rotas que usam registrar_log_auditoria (whitelist e associação de todos os
+usuários a um ambiente) a alteração de negócio é confirmada antes do log, numa transação à parte.
+Se a gravação do log falhar (ou o processo parar antes de a tarefa rodar), a requisição já foi
+respondida com sucesso e o log não é refeito; o erro fica no log da aplicação com o usuário, o
+evento e os detalhes, para reconstrução manual. As demais rotas gravam o log na mesma transação.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import logging
+
+from sqlalchemy.orm import Session
+
+from app.db.database import SessionLocal
+from app.db.models import EventoAuditoria, LogAuditoria
+
+logger = logging.getLogger(__name__)
+
+# nome do evento -> id_evento (carregado no startup; eventos não encontrados são buscados sob demanda)
+AUDIT_EVENT_IDS: Dict[str, int] = {}
+
+
+def carregar_ids_eventos(db: Session) -> None:
+    """Preenche AUDIT_EVENT_IDS com todos os eventos de auditoria cadastrados."""
+    AUDIT_EVENT_IDS.clear()
+    AUDIT_EVENT_IDS.update({nome: id_evento for id_evento, nome in db.query(EventoAuditoria.id_evento, EventoAuditoria.nome)})
+
+
+def obter_id_evento(db: Session, nome: str) -> Optional[int]:
+    """Retorna o id do evento pelo nome, consultando o banco apenas se ainda não estiver em cache."""
+    id_evento = AUDIT_EVENT_IDS.get(nome)
+    if id_evento is None:
+        id_evento = db.query(EventoAuditoria.id_evento).filter_by(nome=nome).scalar()
+        if id_evento is not None:
+            AUDIT_EVENT_IDS[nome] = id_evento
+    return id_evento
+
+
+def registrar_log_auditoria(id_usu, evento_nome: str, detalhes: dict) -> None:
+    """
+    Grava um LogAuditoria numa sessão própria e de curta duração.
+
+    Pensado para ser agendado via BackgroundTasks depois que a alteração de negócio
+    já foi confirmada: a resposta não espera por este commit. Falhas são apenas
+    registradas no log da aplicação, sem afetar a requisição original.
+    """
+    db = SessionLocal()
+    try:
+        id_evento = obter_id_evento(db, evento_nome)
+        if id_evento is None:
+            return
+        db.add(LogAuditoria(
+            id_usu=id_usu,
+            evento_id=id_evento,
+            data_evento=datetime.now(timezone.utc),
+            detalhes=detalhes
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Erro ao gravar log de auditoria '{evento_nome}' (id_usu={id_usu}, detalhes={detalhes}): {e}")
+    finally:
+        db.close()
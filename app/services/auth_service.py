@@ -48,7 +48,7 @@ def create_access_token(data: dict, user: models.Usuario = None) -> str:
             "user_type_id": user.id_tipo,
             "name": user.nome_completo,
             "email": user.email,
-            "is_admin": user.tipo.nome.lower() == "admin"
+            "is_admin": user.is_admin
         })
     
     from app.core.timezone import local_to_utc, now as tz_now
@@ -99,6 +99,6 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
 def require_admin(user = Depends(get_current_user)):
     if not user.id_tipo:
         raise HTTPException(status_code=403, detail="Usuário sem tipo definido.")
-    if user.tipo.nome.lower() != "admin":
+    if not user.is_admin:
         raise HTTPException(status_code=403, detail="Apenas administradores podem realizar esta ação.")
     return user 
\ No newline at end of file
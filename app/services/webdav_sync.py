@@ -4,11 +4,13 @@ Processa todas as pastas e imagens do NextCloud e compara com o banco de dados.
 Todas as operações são feitas em memória para garantir segurança e limpeza automática.
 """
 import hashlib
+import os
 import uuid
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import all_, bindparam, String
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import IntegrityError
 import logging
 import requests
@@ -32,8 +34,8 @@ class WebDAVSync:
         'image/bmp', 'image/tiff', 'image/webp'
     ]
     
-    # Extensões de arquivo permitidas
-    ALLOWED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp']
+    # Extensões de arquivo permitidas (configuráveis via ALLOWED_EXTENSIONS)
+    ALLOWED_EXTENSIONS = settings.ALLOWED_EXTENSIONS
     
     def __init__(self, nextcloud_client: NextCloudClient, db: Session):
         """
@@ -70,7 +72,7 @@ class WebDAVSync:
         """
         # Validação por extensão
         name = file_info.get('name', '').lower()
-        if not any(name.endswith(ext) for ext in self.ALLOWED_EXTENSIONS):
+        if os.path.splitext(name)[1] not in self.ALLOWED_EXTENSIONS:
             return False
         
         # Validação por content_type
@@ -309,6 +311,7 @@ class WebDAVSync:
         now = local_to_utc(tz_now())
         
         for image_info in images:
+            content_hash = None
             try:
                 # Validar imagem
                 if not self._validate_image(image_info):
@@ -320,8 +323,8 @@ class WebDAVSync:
                 if not content_hash:
                     continue
                 
-                # Buscar imagem no banco (usar merge para evitar duplicatas)
-                imagem = self.db.query(Imagem).filter_by(content_hash=content_hash).first()
+                # Buscar imagem no banco pela chave primária (identity map evita nova consulta se já carregada)
+                imagem = self.db.get(Imagem, content_hash)
                 
                 if not imagem:
                     # Nova imagem - usar flush para detectar duplicatas antes do commit
@@ -355,7 +358,7 @@ class WebDAVSync:
                     except IntegrityError:
                         # Imagem foi adicionada por outro processo, fazer merge
                         self.db.rollback()
-                        imagem = self.db.query(Imagem).filter_by(content_hash=content_hash).first()
+                        imagem = self.db.get(Imagem, content_hash)
                         if imagem:
                             # Atualizar imagem existente
                             imagem.nome_img = image_info.get('name', '')
@@ -403,11 +406,12 @@ class WebDAVSync:
                 # Tratar duplicatas explicitamente
                 self.db.rollback()
                 logger.debug(f"  ⚠️ [WebDAV] Duplicata detectada para {image_info.get('name', 'unknown')}, fazendo merge...")
-                # Tentar buscar novamente e atualizar
+                # Tentar buscar novamente e atualizar (reaproveita o hash já calculado; só baixa de novo se faltar)
                 try:
-                    content_hash, _ = self._download_and_process_image(image_info)
+                    if not content_hash:
+                        content_hash, _ = self._download_and_process_image(image_info)
                     if content_hash:
-                        imagem = self.db.query(Imagem).filter_by(content_hash=content_hash).first()
+                        imagem = self.db.get(Imagem, content_hash)
                         if imagem:
                             imagem.nome_img = image_info.get('name', '')
                             imagem.caminho_img = image_info.get('path', '')
@@ -477,23 +481,18 @@ class WebDAVSync:
             Número de imagens marcadas como removidas
         """
         # Obter file_ids das imagens atuais
-        current_file_ids = {img.get('file_id') for img in current_images if img.get('file_id')}
-        
-        # Buscar todas as imagens do conjunto no banco que ainda existem no NextCloud
-        imagens_banco = self.db.query(Imagem).filter(
-            and_(
-                Imagem.id_cnj == conjunto_id,
-                Imagem.existe_no_nextcloud == True
-            )
-        ).all()
-        
-        removed_count = 0
-        for imagem in imagens_banco:
-            file_id = imagem.metadados.get('nextcloud', {}).get('file_id') if imagem.metadados else None
-            if file_id and file_id not in current_file_ids:
-                imagem.existe_no_nextcloud = False
-                imagem.data_sinc = local_to_utc(tz_now())
-                removed_count += 1
+        current_file_ids = [file_id for file_id in {img.get('file_id') for img in current_images} if file_id]
+        
+        # Um único UPDATE no banco: imagens do conjunto ainda marcadas como existentes cujo file_id
+        # (metadados->nextcloud->file_id) não está entre os atuais. Nenhuma imagem é carregada para o Python.
+        file_id_banco = Imagem.metadados['nextcloud']['file_id'].astext
+        now = local_to_utc(tz_now())  # Um único timestamp para o lote
+        removed_count = self.db.query(Imagem).filter(
+            Imagem.id_cnj == conjunto_id,
+            Imagem.existe_no_nextcloud == True,
+            file_id_banco != '',
+            file_id_banco != all_(bindparam('file_ids', current_file_ids, type_=ARRAY(String)))
+        ).update({'existe_no_nextcloud': False, 'data_sinc': now}, synchronize_session=False)
         
         if removed_count > 0:
             self.db.commit()